@@ -1,27 +1,56 @@
 import os
+import re
 import sys
-import glob
+import asyncio
+import multiprocessing
 import time
 import hashlib
 import textwrap
 import requests
 import httpx
+import orjson
+import diskcache
+import cachetools
 import socket
 import json
 import random
 import traceback
-from fastapi.responses import StreamingResponse
+import mmap
+import tempfile
+from fastapi.responses import Response, StreamingResponse
 from fastapi import FastAPI, Query, HTTPException, Request, Body
+from starlette.background import BackgroundTask
 from langchain_chroma import Chroma
 from langchain_ollama import OllamaEmbeddings
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from ddgs import DDGS
-from unstructured.cleaners.core import clean_extra_whitespace, clean_non_ascii_chars, replace_unicode_quotes
 from datetime import datetime, timezone, timedelta
 from pydantic import BaseModel, Field, PrivateAttr, ValidationError
 from typing import Optional, List, Dict, Any, Union, Literal
-from collections import Counter
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import threading
+import numpy as np
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None  # repli sur MD5 si le binding n'est pas installé
+
+try:
+    import tiktoken
+    _TOKEN_ENC = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _TOKEN_ENC = None  # repli sur l'heuristique ~4 caractères/token
+
+# uvloop remplace la boucle asyncio par défaut : mêmes APIs, moins de
+# surcoût par await sur un service purement réseau
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
 
 # --- Configuration via variables d'environnement ---
@@ -50,66 +79,392 @@ try:
 except (ValueError, TypeError):
     QUERY_TIMEOUT = 120
 
+try:
+    EMBED_BATCH = int(os.environ.get("EMBED_BATCH", "64"))
+except (ValueError, TypeError):
+    EMBED_BATCH = 64
+
+try:
+    EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "8"))
+except (ValueError, TypeError):
+    EMBED_CONCURRENCY = 8
+
+try:
+    CHROMA_BATCH = int(os.environ.get("CHROMA_BATCH", "250"))
+except (ValueError, TypeError):
+    CHROMA_BATCH = 250
+
+# Paramètres HNSW de la collection code_completion : les défauts de
+# Chroma (M=16, ef_construction=100, ef_search=10) sont trop faibles
+# pour un corpus de code interrogé avec k=8
+try:
+    HNSW_M = int(os.environ.get("HNSW_M", "32"))
+except (ValueError, TypeError):
+    HNSW_M = 32
+
+try:
+    HNSW_CONSTRUCTION_EF = int(os.environ.get("HNSW_CONSTRUCTION_EF", "200"))
+except (ValueError, TypeError):
+    HNSW_CONSTRUCTION_EF = 200
+
+try:
+    HNSW_SEARCH_EF = int(os.environ.get("HNSW_SEARCH_EF", "64"))
+except (ValueError, TypeError):
+    HNSW_SEARCH_EF = 64
+
+# chat_context est interrogé avec k=2 sur un corpus plus petit : une
+# configuration plus légère suffit et coûte moins cher à la requête
+try:
+    HNSW_SEARCH_EF_CHAT = int(os.environ.get("HNSW_SEARCH_EF_CHAT", "64"))
+except (ValueError, TypeError):
+    HNSW_SEARCH_EF_CHAT = 64
+
 DDGS_SEARCH_ENABLED = True
 
+# Hash du contenu des fichiers (coûteux) en plus du fingerprint stat()
+HASH_CONTENT = os.environ.get("HASH_CONTENT", "0") == "1"
+
+# Dump du payload Ollama sur stderr (sérialisation coûteuse : désactivé
+# par défaut en production)
+DEBUG_PAYLOAD = os.environ.get("DEBUG_PAYLOAD", "0") == "1"
+
+# Si le meilleur extrait RAG atteint ce score de pertinence, la
+# recherche web n'apporte rien et est court-circuitée (0 pour désactiver)
+try:
+    WEB_SKIP_THRESHOLD = float(os.environ.get("WEB_SKIP_THRESHOLD", "0.80"))
+except (ValueError, TypeError):
+    WEB_SKIP_THRESHOLD = 0.80
+
+# Budget de tokens pour le contexte RAG du chat (remplace l'ancienne
+# troncature du prompt aux 8000 derniers caractères)
+try:
+    CTX_BUDGET = int(os.environ.get("CTX_BUDGET", "4096"))
+except (ValueError, TypeError):
+    CTX_BUDGET = 4096
+
+try:
+    SEM_CACHE_THRESHOLD = float(os.environ.get("SEM_CACHE_THRESHOLD", "0.97"))
+except (ValueError, TypeError):
+    SEM_CACHE_THRESHOLD = 0.97
+
+# Intervalle minimal (secondes) entre deux vérifications du hash de
+# /code sur le chemin des requêtes ; le démarrage et /control/reload
+# vérifient toujours
+try:
+    VS_RECHECK_TTL = float(os.environ.get("VS_RECHECK_TTL", "30"))
+except (ValueError, TypeError):
+    VS_RECHECK_TTL = 30.0
+
+# Format de stockage des embeddings dans le cache disque :
+# float32 (exact), float16 (2x plus petit) ou int8 (8x, quantifié)
+EMBED_DTYPE = os.environ.get("EMBED_DTYPE", "float32")
+if EMBED_DTYPE not in ("float32", "float16", "int8"):
+    EMBED_DTYPE = "float32"
+
 
 os.makedirs(PERSIST_DIR, exist_ok=True)
 os.makedirs(CACHE_DIR, exist_ok=True)
 
 
 # --- Nettoyage du code ---
+# Équivalent des cleaners `unstructured` (replace_unicode_quotes,
+# clean_non_ascii_chars, clean_extra_whitespace) en une passe :
+# table de translation + regex précompilées.
+_UNICODE_QUOTES = str.maketrans({
+    "‘": "'", "’": "'",
+    "“": '"', "”": '"',
+    "–": "-", "—": "-",
+})
+_NON_ASCII = re.compile(r"[^\x09\x0a\x0d\x20-\x7e]")
+_EXTRA_WS = re.compile(r"[ \t]+")
+_EXTRA_NL = re.compile(r"\n{3,}")
+
 def clean_code_content(content: str) -> str:
-    cleaned = replace_unicode_quotes(content)
-    cleaned = clean_non_ascii_chars(cleaned)
-    cleaned = clean_extra_whitespace(cleaned)
+    cleaned = content.translate(_UNICODE_QUOTES)
+    cleaned = _NON_ASCII.sub("", cleaned)
+    cleaned = _EXTRA_WS.sub(" ", cleaned)
+    cleaned = _EXTRA_NL.sub("\n\n", cleaned)
     return cleaned
 
 # --- Cache simple ---
-def get_cache_key(question: str) -> str:
-    return hashlib.md5(question.encode()).hexdigest()
+def get_cache_key(question: str) -> bytes:
+    """Clé de cache compacte : 16 octets bruts, sans passage en hexa."""
+    if blake3 is not None:
+        return blake3(question.encode("utf-8")).digest()[:16]
+    return hashlib.md5(question.encode("utf-8")).digest()
+
+def _content_key(text: str) -> str:
+    """Clé de cache adressée par le contenu (BLAKE3 ou MD5)."""
+    if blake3 is not None:
+        return blake3(text.encode("utf-8")).hexdigest()
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+def _encode_vec(vec: List[float]):
+    """Sérialise un embedding pour le cache disque selon EMBED_DTYPE."""
+    if EMBED_DTYPE == "float16":
+        return ("f16", np.asarray(vec, dtype=np.float16).tobytes())
+    if EMBED_DTYPE == "int8":
+        v = np.asarray(vec, dtype=np.float32)
+        scale = float(np.abs(v).max()) or 1.0
+        q = np.round(v / scale * 127.0).astype(np.int8)
+        return ("i8", scale, q.tobytes())
+    return vec
+
+def _decode_vec(stored) -> List[float]:
+    """Opération inverse de _encode_vec (tolère les anciens formats)."""
+    if isinstance(stored, tuple):
+        if stored[0] == "f16":
+            return np.frombuffer(stored[1], dtype=np.float16).astype(np.float32).tolist()
+        if stored[0] == "i8":
+            _, scale, raw = stored
+            v = np.frombuffer(raw, dtype=np.int8).astype(np.float32)
+            return (v * (scale / 127.0)).tolist()
+    return stored
+
+def _quantize_vec(vec: List[float]) -> List[float]:
+    """Aller-retour par le format de EMBED_DTYPE.
+
+    Chroma stocke les vecteurs en float32 quoi qu'il arrive ; ce
+    round-trip garantit que les vecteurs fraîchement calculés subissent
+    la même perte de précision que ceux relus depuis le cache disque,
+    pour des distances cohérentes dans l'index.
+    """
+    if EMBED_DTYPE == "float32":
+        return vec
+    return _decode_vec(_encode_vec(vec))
+
+def _run_async(coro):
+    """Exécute une coroutine depuis du code synchrone.
+
+    Si un event loop tourne déjà (appel depuis un endpoint FastAPI),
+    la coroutine est exécutée dans un thread dédié.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        return ex.submit(asyncio.run, coro).result()
+
+# --- Parcours du code source ---
+# Répertoires ignorés lors du scan (gros et sans fichier .go pertinent)
+_PRUNE_DIRS = {"_", ".git", "vendor", "node_modules"}
+
+def _walk_go(root: str):
+    """Itère (chemin, stat) des fichiers .go sous root.
+
+    os.scandir fournit le stat sans syscall supplémentaire, et les
+    répertoires de _PRUNE_DIRS sont élagués avant d'être parcourus.
+    """
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in _PRUNE_DIRS:
+                            stack.append(entry.path)
+                    elif entry.name.endswith(".go"):
+                        yield entry.path, entry.stat()
+                except OSError:
+                    continue
 
 # --- Hot-reload : hash du code ---
-def hash_code_dir(paths: list) -> str:
-    m = hashlib.md5()
-    for path in paths:
-        abs_path = os.path.join("/code", path) if path != "." else "/code"
-        for f in glob.glob(f"{abs_path}/**/*.go", recursive=True):
-            try:
-                with open(f, "rb") as file:
-                    m.update(file.read())
-            except Exception:
-                continue
-    return m.hexdigest()
+def _new_hasher():
+    """BLAKE3 (SIMD, parallélisable) si disponible, sinon MD5."""
+    return blake3() if blake3 is not None else hashlib.md5()
+
+def _hash_file(path: str) -> bytes:
+    """Hash du contenu d'un seul fichier."""
+    h = _new_hasher()
+    try:
+        if blake3 is not None:
+            h.update_mmap(path)
+        else:
+            with open(path, "rb") as f:
+                h.update(f.read())
+    except Exception:
+        return b""
+    return h.digest()
+
+# Manifest persisté : fingerprint stat() -> dernier hash de contenu,
+# pour ne pas relire les fichiers quand rien n'a bougé entre deux runs
+_MANIFEST_FILE = os.path.join(CACHE_DIR, "code_manifest.json")
+
+def hash_code_dir(roots: list) -> str:
+    """Empreinte du code source pour détecter les changements.
+
+    Première passe sans lecture des fichiers : fingerprint composé de
+    (chemin, mtime_ns, taille) — suffisant dans le cas courant. Si
+    HASH_CONTENT=1, le contenu est aussi hashé, en parallèle, avec un
+    manifest persisté qui court-circuite le re-hash quand le
+    fingerprint n'a pas changé.
+    """
+    entries = []
+    for root in roots:
+        for full, st in _walk_go(root):
+            entries.append((full, st.st_mtime_ns, st.st_size))
+    entries.sort()
+
+    h = _new_hasher()
+    for full, mtime_ns, size in entries:
+        h.update(f"{full}\0{mtime_ns}\0{size}\n".encode())
+    fingerprint = h.hexdigest()
+
+    if not (HASH_CONTENT and entries):
+        return fingerprint
+
+    try:
+        with open(_MANIFEST_FILE) as f:
+            manifest = json.load(f)
+        if manifest.get("fingerprint") == fingerprint:
+            return manifest["hash"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Hash du contenu en parallèle, combiné en ordre trié (déterministe)
+    ch = _new_hasher()
+    ch.update(fingerprint.encode())
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for digest in ex.map(_hash_file, [e[0] for e in entries]):
+            ch.update(digest)
+    content_hash = ch.hexdigest()
+
+    try:
+        with open(_MANIFEST_FILE, "w") as f:
+            json.dump({"fingerprint": fingerprint, "hash": content_hash}, f)
+    except OSError:
+        pass
+
+    return content_hash
 
 # --- Wrapper Nomic Embeddings ---
 from typing import List
 
+# Cache LRU des embeddings de questions : les sessions de chat re-posent
+# très souvent la même question mot pour mot
+_emb_query_lock = threading.Lock()
+_emb_query_cache: OrderedDict = OrderedDict()  # clé texte préfixé -> vecteur
+_EMB_QUERY_MAX = 1024
+
+def _emb_query_get(key: bytes):
+    with _emb_query_lock:
+        if key in _emb_query_cache:
+            _emb_query_cache.move_to_end(key)
+            return _emb_query_cache[key]
+    return None
+
+def _emb_query_put(key: bytes, vec: List[float]):
+    with _emb_query_lock:
+        _emb_query_cache[key] = vec
+        if len(_emb_query_cache) > _EMB_QUERY_MAX:
+            _emb_query_cache.popitem(last=False)
+
 class NomicEmbeddingsWrapper(OllamaEmbeddings):
     """Wrapper Ollama pour les embeddings de code, compatible Chroma."""
     _cached_dim: int = PrivateAttr()  # attribut interne non validé par Pydantic
+    _emb_cache: Any = PrivateAttr()   # cache disque adressé par contenu
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Calcul de la dimension une seule fois
         self._cached_dim = 768 #len(super().embed_query("Hello"))
+        # Cache persistant : un chunk byte-identique n'est jamais ré-embeddé
+        self._emb_cache = diskcache.Cache(os.path.join(CACHE_DIR, "emb"))
 
     def _prefix_text(self, text: str, is_document: bool) -> str:
         """Ajoute un préfixe pour distinguer document vs query."""
         prefix = "search_document: " if is_document else "search_query: "
         return prefix + text
 
+    async def _aembed_batch(self, client: httpx.AsyncClient, sem: asyncio.Semaphore,
+                            batch: List[str]) -> List[List[float]]:
+        """Embedde un lot de textes en un seul appel à l'endpoint batch
+        /api/embed d'Ollama, borné par le sémaphore."""
+        async with sem:
+            r = await client.post(
+                f"{self.base_url or OLLAMA_HOST}/api/embed",
+                json={"model": self.model, "input": batch},
+                timeout=QUERY_TIMEOUT
+            )
+            r.raise_for_status()
+            return r.json().get("embeddings", [])
+
+    async def _aembed_all(self, texts: List[str],
+                          client: httpx.AsyncClient = None) -> List[List[float]]:
+        """Embedde tous les textes par lots de EMBED_BATCH (un appel HTTP
+        par lot), avec au plus EMBED_CONCURRENCY lots en vol vers Ollama.
+
+        Sans client explicite, le client HTTP partagé du process est
+        réutilisé (pool keep-alive : pas de handshake TCP par appel).
+        """
+        sem = asyncio.Semaphore(EMBED_CONCURRENCY)
+        batches = [texts[start:start + EMBED_BATCH]
+                   for start in range(0, len(texts), EMBED_BATCH)]
+        parts = await asyncio.gather(
+            *[self._aembed_batch(client or HTTP, sem, batch)
+              for batch in batches]
+        )
+        return [vec for part in parts for vec in part]
+
+    async def _aembed_all_private_loop(self, texts: List[str]) -> List[List[float]]:
+        """Variante pour les appels synchrones passés par _run_async : le
+        client partagé est lié à l'event loop principal, un loop privé
+        jetable doit donc utiliser son propre client, jetable lui aussi."""
+        limits = httpx.Limits(max_connections=max(16, EMBED_CONCURRENCY * 2))
+        async with httpx.AsyncClient(limits=limits) as client:
+            return await self._aembed_all(texts, client)
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Embeds documents en ajoutant le préfixe, retourne liste de vecteurs float."""
+        """Embeds documents en ajoutant le préfixe, retourne liste de vecteurs float.
+
+        Seuls les textes absents du cache disque sont envoyés à Ollama ;
+        les doublons au sein d'un même appel ne sont embeddés qu'une fois.
+        """
         prefixed_texts = [self._prefix_text(t, is_document=True) for t in texts]
-        embeddings = super().embed_documents(prefixed_texts)
-        # Normaliser les embeddings vides pour éviter les erreurs Chroma
-        return [e if e else [0.0] * self.model_dimensions for e in embeddings]
+        results = [None] * len(prefixed_texts)
+
+        pending = {}  # clé -> indices des textes manquants (dédup intra-appel)
+        for i, text in enumerate(prefixed_texts):
+            key = _content_key(text)
+            cached = self._emb_cache.get(key)
+            if cached is not None:
+                results[i] = _decode_vec(cached)
+            else:
+                pending.setdefault(key, []).append(i)
+
+        if pending:
+            miss_keys = list(pending)
+            miss_texts = [prefixed_texts[pending[k][0]] for k in miss_keys]
+            embeddings = _run_async(self._aembed_all_private_loop(miss_texts))
+            with self._emb_cache.transact():
+                for key, emb in zip(miss_keys, embeddings):
+                    # Normaliser les embeddings vides pour éviter les erreurs Chroma
+                    vec = emb if emb else [0.0] * self.model_dimensions
+                    self._emb_cache.set(key, _encode_vec(vec))
+                    vec = _quantize_vec(vec)
+                    for i in pending[key]:
+                        results[i] = vec
+
+        return results
 
     def embed_query(self, text: str) -> List[float]:
-        """Embeds une query en ajoutant le préfixe."""
-        emb = super().embed_query(self._prefix_text(text, is_document=False))
+        """Embeds une query en ajoutant le préfixe (avec cache LRU)."""
+        prefixed = self._prefix_text(text, is_document=False)
+        key = get_cache_key(prefixed)
+        cached = _emb_query_get(key)
+        if cached is not None:
+            return cached
+        emb = super().embed_query(prefixed)
         # Normaliser embedding vide
-        return emb if emb else [0.0] * self.model_dimensions
+        emb = emb if emb else [0.0] * self.model_dimensions
+        _emb_query_put(key, emb)
+        return emb
 
     @property
     def model_dimensions(self) -> int:
@@ -118,6 +473,15 @@ class NomicEmbeddingsWrapper(OllamaEmbeddings):
 # --- FastAPI ---
 app = FastAPI()
 
+# --- Client HTTP partagé vers Ollama ---
+# Un seul client pour tout le process : pool de connexions keep-alive,
+# donc pas de handshake TCP à chaque requête. Fermé au shutdown.
+HTTP = httpx.AsyncClient(
+    base_url=OLLAMA_HOST,
+    limits=httpx.Limits(max_connections=128, max_keepalive_connections=64),
+    timeout=httpx.Timeout(QUERY_TIMEOUT, connect=5.0),
+)
+
 # --- Traitement des chemins ---
 
 
@@ -125,108 +489,301 @@ src_paths_directories = SRC_PATH.split(":")
 if not src_paths_directories:
     src_paths_directories = ["."]
 
+# Répertoires absolus scannés, résolus une seule fois au démarrage
+CODE_ROOTS = [os.path.join("/code", p) if p != "." else "/code"
+              for p in src_paths_directories]
+
 # --- Initialisation ---
 vectorstore = None
+embedding_fn = None
 code_hash = ""
 
-def build_vectorstore():
-    global vectorstore, code_hash, src_paths_directories
+# Hash du code persisté à côté de l'index Chroma : permet de sauter la
+# ré-indexation complète après un redémarrage du conteneur
+_CODE_HASH_FILE = os.path.join(PERSIST_DIR, ".code_hash")
+
+# --- Chargement du code ---
+def _load_one(path: str) -> Document:
+    """Lit et nettoie un fichier source (exécuté dans un worker)."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    except OSError:
+        text = ""
+    return Document(page_content=clean_code_content(text),
+                    metadata={"source": path})
+
+try:
+    LOAD_THREADS = int(os.environ.get("LOAD_THREADS", str(os.cpu_count() or 4)))
+except (ValueError, TypeError):
+    LOAD_THREADS = os.cpu_count() or 4
+
+def _load_documents_parallel(files: list) -> list:
+    """Lecture + nettoyage fusionnés, répartis sur plusieurs processus."""
+    if not files:
+        return []
+    with ProcessPoolExecutor(max_workers=LOAD_THREADS) as ex:
+        return [doc for doc in ex.map(_load_one, files, chunksize=32)
+                if doc.page_content.strip()]
+
+# --- Découpage du code en chunks ---
+# Splitter construit une seule fois au chargement du module : les
+# workers fork() en héritent, inutile de reconstruire les séparateurs
+# du langage à chaque shard ou à chaque reload
+CODE_SPLITTER = RecursiveCharacterTextSplitter.from_language(
+    language=PROG_LANG,
+    chunk_size=CHUNCK_SIZE,
+    chunk_overlap=CHUNCK_OVERLAP,
+    keep_separator=True
+)
+
+def _split_shard(docs: list) -> list:
+    """Découpe un shard de documents (exécuté dans un worker)."""
+    return CODE_SPLITTER.split_documents(docs)
+
+def _split_documents_parallel(all_docs: list) -> list:
+    """Répartit le découpage sur plusieurs processus (travail CPU pur,
+    bloqué par le GIL en multithread)."""
+    n_workers = max(1, (os.cpu_count() or 2) - 1)
+    if n_workers == 1 or len(all_docs) <= n_workers:
+        return _split_shard(all_docs)
+
+    splits = []
+    ctx = multiprocessing.get_context("fork")
+    shards = [all_docs[i::n_workers] for i in range(n_workers)]
+    with ctx.Pool(processes=n_workers) as pool:
+        for part in pool.imap_unordered(_split_shard, shards):
+            splits.extend(part)
+    return splits
+
+# Sérialise les (re)constructions : sans ce verrou, plusieurs premières
+# requêtes simultanées déclencheraient chacune une indexation complète
+_vs_lock = asyncio.Lock()
+_vs_checked_at = 0.0  # dernière vérification du hash (time.monotonic)
+
+async def build_vectorstore(force: bool = False):
+    """Version asynchrone : construit le vectorstore hors de l'event loop.
+
+    Le corps synchrone (langchain/Chroma) part dans un thread pour ne
+    pas bloquer les autres endpoints pendant une réindexation. Sur le
+    chemin des requêtes, le re-calcul du fingerprint de /code (walk +
+    stat de tout l'arbre) est limité à une fois par VS_RECHECK_TTL
+    secondes ; force=True (reload explicite) vérifie toujours.
+    """
+    global _vs_checked_at
+    if not force and vectorstore is not None \
+            and time.monotonic() - _vs_checked_at < VS_RECHECK_TTL:
+        return
+    async with _vs_lock:
+        if not force and vectorstore is not None \
+                and time.monotonic() - _vs_checked_at < VS_RECHECK_TTL:
+            return
+        await asyncio.to_thread(_build_vectorstore_sync)
+        _vs_checked_at = time.monotonic()
+
+def _build_vectorstore_sync():
+    global vectorstore, embedding_fn, code_hash, src_paths_directories
     print("🔹 Construction du vectorstore ...", file=sys.stderr)
     
 
     # Hash du code pour hot-reload
-    new_hash = hash_code_dir(src_paths_directories)
+    new_hash = hash_code_dir(CODE_ROOTS)
     if vectorstore and new_hash == code_hash:
         print("🔹 Pas de changement dans /code, utilisation du vectorstore existant", file=sys.stderr)
         return
+    if code_hash and new_hash != code_hash:
+        # Le code a changé : les contextes RAG cachés sont périmés
+        _clear_rag_cache()
     code_hash = new_hash
 
+    # Redémarrage avec un index persisté à jour : rechargement direct
+    if vectorstore is None and os.path.exists(os.path.join(PERSIST_DIR, "chroma.sqlite3")):
+        try:
+            with open(_CODE_HASH_FILE) as f:
+                disk_hash = f.read().strip()
+        except OSError:
+            disk_hash = ""
+        if disk_hash == new_hash:
+            print("🔹 Index persisté à jour, rechargement sans ré-indexation", file=sys.stderr)
+            embedding = NomicEmbeddingsWrapper(model=EMBED_MODEL, base_url=OLLAMA_HOST)
+            embedding_fn = embedding
+            vectorstore = {
+                "chat": Chroma(
+                    persist_directory=PERSIST_DIR,
+                    embedding_function=embedding,
+                    collection_name="chat_context"
+                ),
+                "generate": Chroma(
+                    persist_directory=PERSIST_DIR,
+                    embedding_function=embedding,
+                    collection_name="code_completion"
+                ),
+            }
+            return
+
     print(f"  🔹 Programmation language: {PROG_LANG}", file=sys.stderr)
     print(f"  🔹 Chunck size: {CHUNCK_SIZE}", file=sys.stderr)
     print(f"  🔹 Chunck overlap: {CHUNCK_OVERLAP}", file=sys.stderr)
-    # Text splitter optimisé Go
-    code_splitter = RecursiveCharacterTextSplitter.from_language(
-        language=PROG_LANG,
-        chunk_size=CHUNCK_SIZE,
-        chunk_overlap=CHUNCK_OVERLAP, 
-        keep_separator=True 
-    )
 
-    all_docs = []
-    for path in src_paths_directories:
-        abs_path = os.path.join("/code", path) if path != "." else "/code"
+    files = []
+    for abs_path in CODE_ROOTS:
         print(f"   🔹 Chargement du code Go depuis: {abs_path}", file=sys.stderr)
-        loader = DirectoryLoader(
-            abs_path,
-            glob="**/*.go",
-            loader_cls=TextLoader,
-            use_multithreading=True,
-            loader_kwargs={'autodetect_encoding': True}
-        )
-        loaded_docs = loader.load()
-        print(f"   🔸 {len(loaded_docs)} fichiers chargés", file=sys.stderr)
-        for doc in loaded_docs:
-            doc.page_content = clean_code_content(doc.page_content)
-        all_docs.extend(loaded_docs)
+        files.extend(path for path, _ in _walk_go(abs_path))
+    print(f"   🔸 {len(files)} fichiers à charger", file=sys.stderr)
+
+    all_docs = _load_documents_parallel(files)
 
     print(f"🔹 {len(all_docs)} documents après chargement", file=sys.stderr)
 
     embedding = NomicEmbeddingsWrapper(model=EMBED_MODEL, base_url=OLLAMA_HOST)
+    embedding_fn = embedding
 
-    chat_collection = Chroma.from_documents(
-        documents=all_docs,
-        embedding=embedding,
+    chat_collection = Chroma(
+        embedding_function=embedding,
         persist_directory=PERSIST_DIR,
-        collection_metadata={"hnsw:space": "cosine"},
+        collection_metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": 16,
+            "hnsw:construction_ef": 100,
+            "hnsw:search_ef": HNSW_SEARCH_EF_CHAT,
+        },
         collection_name="chat_context"
     )
 
-    splits = code_splitter.split_documents(all_docs)
+    # Ingestion incrémentale : un fichier dont le hash de contenu est
+    # déjà indexé n'est pas ré-embeddé ; les versions obsolètes et les
+    # fichiers disparus sont supprimés de la collection
+    chat_col = chat_collection._collection
+    existing_chat = {}
+    got = chat_col.get(include=["metadatas"])
+    for chunk_id, meta in zip(got["ids"], got["metadatas"] or []):
+        meta = meta or {}
+        existing_chat.setdefault(meta.get("source"), []).append(
+            (chunk_id, meta.get("file_hash")))
+
+    to_add = []
+    obsolete_ids = []
+    current_sources = set()
+    for doc in all_docs:
+        source = doc.metadata.get("source")
+        current_sources.add(source)
+        file_hash = _content_key(doc.page_content)
+        doc.metadata["file_hash"] = file_hash
+        previous = existing_chat.get(source)
+        if previous and all(h == file_hash for _, h in previous):
+            continue  # fichier inchangé
+        if previous:
+            obsolete_ids.extend(chunk_id for chunk_id, _ in previous)
+        to_add.append(doc)
+    for source, previous in existing_chat.items():
+        if source not in current_sources:
+            obsolete_ids.extend(chunk_id for chunk_id, _ in previous)
+
+    if obsolete_ids:
+        chat_col.delete(ids=obsolete_ids)
+    if to_add:
+        chat_collection.add_documents(to_add)
+    print(f"🔹 chat_context: {len(to_add)} fichiers (ré)indexés, "
+          f"{len(obsolete_ids)} supprimés", file=sys.stderr)
+
+    splits = _split_documents_parallel(all_docs)
     print(f"🔹 {len(splits)} chunks créés", file=sys.stderr)
 
     splits = [doc for doc in splits if doc.page_content.strip()]
 
-    # Ajout des statistiques de longueur du split
-    bins=50
-    counter = Counter(int(len(split.page_content) / bins) * bins for split in splits)
+    # Ajout des statistiques de longueur du split (histogramme vectorisé)
+    bins = 50
+    lengths = np.fromiter((len(s.page_content) for s in splits),
+                          dtype=np.int32, count=len(splits))
+    counts = np.bincount(lengths // bins)
     print("🔹 Histogramme de la longueur des splits :", file=sys.stderr)
-    max_value = max(counter.values())
-    for length, count in sorted(counter.items()):
+    max_value = int(counts.max()) if counts.size else 1
+    for i, count in enumerate(counts):
+        if not count:
+            continue
         normalized_count = int((count / max_value) * 50)
-        print(f"   {length+1:6}-{length+bins:-6}: { '#' * normalized_count}", file=sys.stderr)
+        print(f"   {i*bins+1:6}-{(i+1)*bins:-6}: { '#' * normalized_count}", file=sys.stderr)
 
     print(f"🔹 {len(splits)} fragments non vides à intégrer", file=sys.stderr)
     # Créer ou recharger Chroma
 
     # 2. Vectorstore pour la Génération (splits courts)
-    gen_collection = Chroma.from_documents(
-        documents=splits,  # Morceaux de 200-400 tokens
-        embedding=embedding,
+    gen_collection = Chroma(
+        embedding_function=embedding,
         collection_name="code_completion",
         persist_directory=PERSIST_DIR,
-        collection_metadata={"hnsw:space": "cosine"}
+        collection_metadata={
+            "hnsw:space": "cosine",
+            "hnsw:M": HNSW_M,
+            "hnsw:construction_ef": HNSW_CONSTRUCTION_EF,
+            "hnsw:search_ef": HNSW_SEARCH_EF,
+        }
     )
 
+    # Ids déterministes dérivés du contenu : les chunks déjà présents
+    # dans la collection persistée ne sont ni ré-embeddés ni ré-insérés
+    col = gen_collection._collection
+    existing = set(col.get(include=[])["ids"])  # récupération des ids seuls
+
+    chunk_ids = [_content_key(doc.page_content) for doc in splits]
+
+    pending = []
+    seen = set(existing)
+    for chunk_id, doc in zip(chunk_ids, splits):
+        if chunk_id not in seen:
+            seen.add(chunk_id)
+            pending.append((chunk_id, doc))
+
+    # Purge des chunks dont le contenu n'existe plus dans le code :
+    # sans elle, la collection accumule les versions mortes des
+    # fichiers édités et la recherche peut renvoyer du code disparu
+    stale = list(existing - set(chunk_ids))
+    if stale:
+        for k in range(0, len(stale), CHROMA_BATCH):
+            col.delete(ids=stale[k:k + CHROMA_BATCH])
+
+    print(f"🔹 {len(pending)} nouveaux fragments "
+          f"({len(existing)} déjà indexés, {len(stale)} purgés)", file=sys.stderr)
+
+    if pending:
+        # Embeddings calculés en une passe, hors du chemin d'insertion Chroma
+        embs = embedding.embed_documents([doc.page_content for _, doc in pending])
+        for k in range(0, len(pending), CHROMA_BATCH):
+            batch = pending[k:k + CHROMA_BATCH]
+            col.add(
+                ids=[chunk_id for chunk_id, _ in batch],
+                documents=[doc.page_content for _, doc in batch],
+                metadatas=[doc.metadata for _, doc in batch],
+                embeddings=embs[k:k + CHROMA_BATCH]
+            )
+
     vectorstore = {
         "chat": chat_collection,
         "generate": gen_collection
        }
 
+    try:
+        with open(_CODE_HASH_FILE, "w") as f:
+            f.write(code_hash)
+    except OSError as e:
+        print(f"⚠️ Impossible d'écrire {_CODE_HASH_FILE}: {e}", file=sys.stderr)
+
     print("🔹 Vectorstore créé", file=sys.stderr)
 
 # --- Formatage du contexte ---
 def format_context(docs: list) -> str:
     context = []
-            
-    extraits = {}
+
+    seen: set = set()  # empreintes des extraits déjà retenus
     print("🔹 Les fichiers suivants ont été selectionnés:", file=sys.stderr)
 
     for i, doc in enumerate(docs):
         source = doc.metadata.get('source', 'unknown')
         filename = os.path.basename(source)
         print(f"  🔹 {filename} -- extrait {i+1} --", file=sys.stderr)
-        if doc.page_content not in extraits:
-            extraits[doc.page_content] = True
+        h = hash(doc.page_content)
+        if h not in seen:
+            seen.add(h)
             context.append(f"### Fichier: {filename} (Extrait {i+1}) ###")
             context.append(textwrap.indent(doc.page_content, '    '))
             print(f"  🔹 {filename} -- fin extrait {i+1} --", file=sys.stderr)
@@ -235,31 +792,99 @@ def format_context(docs: list) -> str:
 
     return "\n\n".join(context)
 
+# --- Cache disque des réponses /api/generate (non-streaming) ---
+# Arborescence shardée par les premiers octets hexa de la clé : un
+# répertoire plat à plusieurs milliers d'entrées coûte cher en lookup
+_ANSWER_CACHE_DIR = os.path.join(CACHE_DIR, "generate")
+
+# LRU mémoire au-dessus du cache disque : les questions chaudes ne
+# paient même plus l'open() + mmap
+_answer_mem: OrderedDict = OrderedDict()
+_ANSWER_MEM_MAX = 256
+_answer_mem_lock = threading.Lock()
+
+def _answer_mem_get(key: str):
+    with _answer_mem_lock:
+        payload = _answer_mem.get(key)
+        if payload is not None:
+            _answer_mem.move_to_end(key)
+        return payload
+
+def _answer_mem_put(key: str, payload: bytes):
+    with _answer_mem_lock:
+        _answer_mem[key] = payload
+        _answer_mem.move_to_end(key)
+        if len(_answer_mem) > _ANSWER_MEM_MAX:
+            _answer_mem.popitem(last=False)
+
+def _answer_cache_path(key: str) -> str:
+    return os.path.join(_ANSWER_CACHE_DIR, key[:2], key[2:4], key + ".json")
+
+def _answer_cache_get(key: str):
+    """Relit une réponse cachée via mmap, None si absente."""
+    path = _answer_cache_path(key)
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+            try:
+                return bytes(mm)
+            finally:
+                mm.close()
+    except (OSError, ValueError):
+        return None
+
+def _answer_cache_put(key: str, payload: bytes):
+    """Écrit une réponse de façon atomique (fichier temporaire + rename)."""
+    path = _answer_cache_path(key)
+    shard = os.path.dirname(path)
+    try:
+        os.makedirs(shard, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=shard)
+        with os.fdopen(fd, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"⚠️ Cache réponse inaccessible: {e}", file=sys.stderr)
+
+def _count_tokens(text: str) -> int:
+    """Nombre de tokens du texte (tiktoken si disponible)."""
+    if _TOKEN_ENC is not None:
+        return len(_TOKEN_ENC.encode(text))
+    return len(text) // 4
+
+def _pack_context(context: str, budget: int) -> str:
+    """Ramène le contexte RAG sous le budget de tokens.
+
+    Les extraits les moins similaires (renvoyés en dernier par la
+    recherche) sont retirés en entier, plutôt que de couper le prompt
+    au milieu d'un extrait — et surtout sans toucher à la consigne ni
+    à la question qui entourent le contexte.
+    """
+    if _count_tokens(context) <= budget:
+        return context
+    sep = "\n\n### Fichier:"
+    parts = context.split(sep)
+    while len(parts) > 1 and _count_tokens(sep.join(parts)) > budget:
+        parts.pop()
+    return sep.join(parts)
+
+# Décalage horaire local calculé une seule fois au démarrage.
+# Le signe est pris sur le total en secondes (et pas sur les heures),
+# sinon les décalages fractionnaires négatifs comme -05:30 sont faux.
+_LOCAL_TZ = datetime.now().astimezone().tzinfo
+_OFFSET_SECONDS = int(_LOCAL_TZ.utcoffset(None).total_seconds())
+_OFFSET_ABS = abs(_OFFSET_SECONDS)
+_OFFSET_STR = (f"{'-' if _OFFSET_SECONDS < 0 else '+'}"
+               f"{_OFFSET_ABS // 3600:02d}:{(_OFFSET_ABS % 3600) // 60:02d}")
+
 def format_iso_time_with_ns():
-    # 1. Obtenir le timestamp actuel avec nanosecondes
-    current_time_ns = time.time_ns()
-    
-    # 2. Convertir en datetime avec timezone locale
-    dt = datetime.fromtimestamp(current_time_ns / 1e9).astimezone()
-    
-    # 3. Formater avec les nanosecondes et décalage horaire
-    # - Extraire les nanosecondes
-    nanoseconds = current_time_ns % 10**9
-    
-    # - Formater la partie datetime de base
-    base_format = dt.strftime("%Y-%m-%dT%H:%M:%S")
-    
-    # - Ajouter les nanosecondes (9 chiffres)
-    nano_format = f".{nanoseconds:09d}"
-    
-    # - Formater le décalage horaire
-    utc_offset = dt.utcoffset()
-    offset_hours = utc_offset.total_seconds() // 3600
-    offset_minutes = (utc_offset.total_seconds() % 3600) // 60
-    offset_sign = '-' if offset_hours < 0 else '+'
-    offset_format = f"{offset_sign}{abs(int(offset_hours)):02d}:{int(offset_minutes):02d}"
-    
-    return base_format + nano_format + offset_format
+    """Timestamp ISO-8601 avec nanosecondes et décalage horaire local."""
+    ns = time.time_ns()
+    sec, nano = divmod(ns, 1_000_000_000)
+    lt = time.localtime(sec)
+    return (f"{lt.tm_year:04d}-{lt.tm_mon:02d}-{lt.tm_mday:02d}"
+            f"T{lt.tm_hour:02d}:{lt.tm_min:02d}:{lt.tm_sec:02d}"
+            f".{nano:09d}{_OFFSET_STR}")
 
 
 # Modèles Pydantic pour l'API compatible Ollama
@@ -292,42 +917,257 @@ class EmbeddingRequest(BaseModel):
 class EmbeddingResponse(BaseModel):
     embedding: List[float]
 
+# --- Micro-batching des embeddings de questions ---
+class _QueryBatcher:
+    """Regroupe les embeddings de questions arrivés dans une courte
+    fenêtre (quelques ms) en un seul appel vers Ollama, pour amortir le
+    coût par requête quand plusieurs clients interrogent en parallèle."""
+
+    def __init__(self, window_ms: float = 5.0, max_batch: int = 16):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker = None
+
+    async def embed(self, text: str) -> List[float]:
+        key = get_cache_key(embedding_fn._prefix_text(text, is_document=False))
+        cached = _emb_query_get(key)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._worker = loop.create_task(self._run())
+        future = loop.create_future()
+        await self._queue.put((text, future))
+        vec = await future
+        _emb_query_put(key, vec)
+        return vec
+
+    async def _run(self):
+        while True:
+            try:
+                first = await asyncio.wait_for(self._queue.get(), timeout=1.0)
+            except asyncio.TimeoutError:
+                return  # file vide : le worker s'arrête, relancé au besoin
+            batch = [first]
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(),
+                                                        timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [embedding_fn._prefix_text(t, is_document=False)
+                     for t, _ in batch]
+            try:
+                vectors = await embedding_fn._aembed_all(texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), vec in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(
+                        vec if vec else [0.0] * embedding_fn.model_dimensions)
+
+_query_batcher = _QueryBatcher()
+
+# --- Cache des contextes RAG (exact + sémantique) ---
+_rag_cache_lock = threading.Lock()
+_rag_exact: OrderedDict = OrderedDict()       # (mode, clé question) -> (contexte, score)
+_RAG_EXACT_MAX = 1024
+_sem_cache: deque = deque(maxlen=512)         # (mode, vecteur normalisé fp16, contexte, score)
+_SEM_CACHE_FILE = os.path.join(CACHE_DIR, "sem_cache.npz")
+# v2 : les scores persistés sont des pertinences (1 - distance cosinus) ;
+# les fichiers plus anciens contenaient la distance brute et sont ignorés
+_SEM_CACHE_FMT = 2
+
+def _clear_rag_cache():
+    """Vide les deux niveaux de cache des contextes RAG."""
+    with _rag_cache_lock:
+        _rag_exact.clear()
+        _sem_cache.clear()
+
+def _load_sem_cache():
+    """Recharge le cache sémantique persisté au démarrage.
+
+    Le cache est ignoré si le hash du code a changé depuis sa
+    sauvegarde : les contextes qu'il contient seraient périmés.
+    """
+    if not os.path.exists(_SEM_CACHE_FILE):
+        return
+    try:
+        data = np.load(_SEM_CACHE_FILE, allow_pickle=True)
+        if "code_hash" in data and str(data["code_hash"]) != code_hash:
+            print("🔹 Cache sémantique périmé (code modifié), ignoré", file=sys.stderr)
+            return
+        if "fmt" not in data or int(data["fmt"]) != _SEM_CACHE_FMT:
+            print("🔹 Cache sémantique d'un ancien format, ignoré", file=sys.stderr)
+            return
+        scores = data["scores"] if "scores" in data else np.zeros(len(data["modes"]))
+        for mode, vec, ctx, score in zip(data["modes"], data["vectors"],
+                                         data["contexts"], scores):
+            _sem_cache.append((str(mode), vec.astype(np.float16), str(ctx),
+                               float(score)))
+        print(f"🔹 Cache sémantique rechargé ({len(_sem_cache)} entrées)", file=sys.stderr)
+    except Exception as e:
+        print(f"⚠️ Cache sémantique illisible: {e}", file=sys.stderr)
+
+def _save_sem_cache():
+    """Persiste le cache sémantique sur disque, tagué par le hash du code."""
+    with _rag_cache_lock:
+        if not _sem_cache:
+            return
+        modes = np.array([m for m, _, _, _ in _sem_cache])
+        vectors = np.stack([v for _, v, _, _ in _sem_cache])
+        contexts = np.array([c for _, _, c, _ in _sem_cache], dtype=object)
+        scores = np.array([s for _, _, _, s in _sem_cache], dtype=np.float32)
+    try:
+        np.savez_compressed(_SEM_CACHE_FILE, modes=modes, vectors=vectors,
+                            contexts=contexts, scores=scores,
+                            code_hash=np.array(code_hash),
+                            fmt=np.array(_SEM_CACHE_FMT))
+    except Exception as e:
+        print(f"⚠️ Impossible de sauver le cache sémantique: {e}", file=sys.stderr)
+
+# Pool dédié aux recherches HNSW : borné (le parcours de graphe est du
+# CPU natif, inutile de sur-souscrire) et séparé du pool par défaut
+# d'asyncio.to_thread pour que DDGS ou une réindexation ne puissent pas
+# affamer la recherche
+_search_pool = ThreadPoolExecutor(max_workers=4)
+
 # Fonctions utilitaires
-async def perform_rag_search(mode: Literal["generate", "chat"], prompt: str, k: int = 4) -> str:
-    """Effectue une recherche RAG et retourne le contexte"""
-    build_vectorstore()
-    
-    rag_docs = vectorstore[mode].similarity_search(prompt, k=k)
-    return format_context(rag_docs) if rag_docs else "Aucun contexte trouvé."
+async def perform_rag_search(mode: Literal["generate", "chat"], prompt: str, k: int = 4) -> tuple:
+    """Effectue une recherche RAG, retourne (contexte, score du meilleur extrait).
+
+    Deux niveaux de cache : correspondance exacte sur la question, puis
+    correspondance sémantique (cosinus > SEM_CACHE_THRESHOLD) sur
+    l'embedding de la question. Le score de pertinence n'est calculé
+    qu'en mode chat (il sert à court-circuiter la recherche web) ;
+    il vaut 0.0 en mode generate.
+    """
+    await build_vectorstore()
+
+    key = (mode, get_cache_key(prompt))
+    with _rag_cache_lock:
+        if key in _rag_exact:
+            _rag_exact.move_to_end(key)
+            return _rag_exact[key]
+
+    # Embedding de la question calculé une seule fois (via le
+    # micro-batcher) : il sert au cache sémantique puis à la recherche
+    # par vecteur
+    q = np.asarray(await _query_batcher.embed(prompt), dtype=np.float32)
+    q_norm = (q / (np.linalg.norm(q) or 1.0)).astype(np.float16)
+
+    with _rag_cache_lock:
+        candidates = [(vec, ctx, score) for m, vec, ctx, score in _sem_cache
+                      if m == mode]
+        if candidates:
+            matrix = np.stack([vec for vec, _, _ in candidates]).astype(np.float32)
+            sims = matrix @ q_norm.astype(np.float32)
+            best = int(sims.argmax())
+            if sims[best] > SEM_CACHE_THRESHOLD:
+                return candidates[best][1], candidates[best][2]
+
+    # similarity_search est bloquant : exécution dans un thread pour ne
+    # pas figer l'event loop pendant que la recherche web tourne.
+    # En mode chat, MMR diversifie les extraits : moins de redondance,
+    # donc plus de contexte utile dans le budget de tokens
+    loop = asyncio.get_running_loop()
+    top_score = 0.0
+    if mode == "chat":
+        rag_docs = await loop.run_in_executor(
+            _search_pool,
+            vectorstore[mode].max_marginal_relevance_search_by_vector,
+            q.tolist(), k, k * 4)
+        # Sonde k=1 : malgré son nom, l'API "relevance_scores" par
+        # vecteur renvoie la distance brute de Chroma (plus petit =
+        # plus proche). L'index est en hnsw:space=cosine, donc la
+        # pertinence du meilleur extrait vaut 1 - distance
+        probe = await loop.run_in_executor(
+            _search_pool,
+            vectorstore[mode].similarity_search_by_vector_with_relevance_scores,
+            q.tolist(), 1)
+        if probe:
+            top_score = 1.0 - float(probe[0][1])
+    else:
+        rag_docs = await loop.run_in_executor(
+            _search_pool,
+            vectorstore[mode].similarity_search_by_vector, q.tolist(), k)
+    context = format_context(rag_docs) if rag_docs else "Aucun contexte trouvé."
+
+    with _rag_cache_lock:
+        _rag_exact[key] = (context, top_score)
+        if len(_rag_exact) > _RAG_EXACT_MAX:
+            _rag_exact.popitem(last=False)
+        _sem_cache.append((mode, q_norm, context, top_score))
+
+    return context, top_score
+
+# Session DDGS réutilisée entre les requêtes + cache TTL des résultats :
+# les mêmes questions reviennent souvent à quelques minutes d'intervalle
+_ddgs = DDGS()
+_web_cache = cachetools.TTLCache(maxsize=2048, ttl=600)
+
+# Disjoncteur : après _WEB_BREAKER_MAX échecs consécutifs, la recherche
+# web est court-circuitée pendant _WEB_BREAKER_COOLDOWN secondes au lieu
+# de faire payer un timeout DDGS à chaque requête chat
+_WEB_BREAKER_MAX = 3
+_WEB_BREAKER_COOLDOWN = 30.0
+_web_failures = 0
+_web_breaker_until = 0.0
 
 async def perform_web_search(prompt: str, k: int = 2) -> str:
     """Effectue une recherche web et retourne les résultats"""
+    global _web_failures, _web_breaker_until
+
     if not DDGS_SEARCH_ENABLED:
         return "Recherche web désactivée"
-    
+
+    if time.monotonic() < _web_breaker_until:
+        return "Aucun résultat web disponible"
+
+    key = get_cache_key(prompt)
+    cached = _web_cache.get(key)
+    if cached is not None:
+        return cached
+
     try:
-        from ddgs import DDGS
-        with DDGS() as ddgs:
-            results = list(ddgs.text(prompt, max_results=k))
-            print(f"🔹 {len(results)} résultats trouvés sur le web", file=sys.stderr)
-            for i, r in enumerate(results):  
-                print(f" - {i+1}. {r['title']} : {r['href']}", file=sys.stderr)
-            
-            web_info = "\n".join(
-                f"- [{r['title']}]({r['href']}): {r['body'][:150]}..." 
-                for r in results
-            ) if results else "Aucun résultat web trouvé."
+        # DDGS est bloquant : exécution dans un thread pour ne pas
+        # figer l'event loop
+        results = await asyncio.to_thread(
+            lambda: list(_ddgs.text(prompt, max_results=k)))
+        print(f"🔹 {len(results)} résultats trouvés sur le web", file=sys.stderr)
+        for i, r in enumerate(results):
+            print(f" - {i+1}. {r['title']} : {r['href']}", file=sys.stderr)
+
+        web_info = "\n".join(
+            f"- [{r['title']}]({r['href']}): {r['body'][:150]}..."
+            for r in results
+        ) if results else "Aucun résultat web trouvé."
+        _web_cache[key] = web_info
+        _web_failures = 0
+        return web_info
     except Exception as e:
+        _web_failures += 1
+        if _web_failures >= _WEB_BREAKER_MAX:
+            _web_breaker_until = time.monotonic() + _WEB_BREAKER_COOLDOWN
+            print(f"⚠️ Recherche web suspendue {_WEB_BREAKER_COOLDOWN:.0f}s "
+                  f"après {_web_failures} échecs", file=sys.stderr)
         return f"Erreur recherche web: {str(e)}"
 
-def build_enhanced_prompt(
-                 mode: Literal["generate", "chat"], 
-                 question: str,
-                 rag_context: str,
-                 web_context: str):
-    
-    if mode == "chat":
-        prompt = f"""
+# Parties fixes des prompts, assemblées une seule fois à l'import
+# (PROG_LANG est connu au chargement) : par requête il ne reste qu'un
+# "".join des morceaux constants et des morceaux variables
+_CHAT_PROMPT_HEAD = f"""
 # Consigne
 
 Vous êtes un expert en programmation {PROG_LANG}. Répondez à la question en utilisant le contexte fourni (extraits de code) et les informations web si disponibles.
@@ -337,11 +1177,15 @@ Autant que possible tu indiqueras tes sources, url, nom du fichier source...
 
 ## **Contexte Code (extraits pertinents):**
 
-{rag_context}
+"""
+
+_CHAT_PROMPT_MID = """
 
 ## **Informations Web:**
 
-{web_context}
+"""
+
+_CHAT_PROMPT_TAIL = """
 
 ## **Instructions:**
 - Répondez de manière concise et précise à la question
@@ -352,10 +1196,9 @@ Autant que possible tu indiqueras tes sources, url, nom du fichier source...
 
 # **Question** à laquelle tu dois répondre
 
-{question}
 """
-    else:
-        prompt=f"""
+
+_GEN_PROMPT_HEAD = f"""
 # Consigne
 
 Vous êtes un expert en programmation {PROG_LANG}. Essayer de concevoir un petit bout de code permetant de résoudre la question
@@ -364,7 +1207,9 @@ Vous êtes un expert en programmation {PROG_LANG}. Essayer de concevoir un petit
 
 ## **Contexte Code (extraits pertinents):**
 
-{rag_context}
+"""
+
+_GEN_PROMPT_TAIL = """
 
 ## **Instructions:**
 
@@ -375,10 +1220,19 @@ Vous êtes un expert en programmation {PROG_LANG}. Essayer de concevoir un petit
 
 # **Question** à laquelle tu dois répondre
 
-{question}
 """
 
-    return prompt
+def build_enhanced_prompt(
+                 mode: Literal["generate", "chat"],
+                 question: str,
+                 rag_context: str,
+                 web_context: str):
+
+    if mode == "chat":
+        return "".join((_CHAT_PROMPT_HEAD, rag_context, _CHAT_PROMPT_MID,
+                        web_context, _CHAT_PROMPT_TAIL, question, "\n"))
+    return "".join((_GEN_PROMPT_HEAD, rag_context, _GEN_PROMPT_TAIL,
+                    question, "\n"))
 
 # --- Fonctions utilitaires factorisées ---
 async def build_augmented_prompt(
@@ -387,11 +1241,25 @@ async def build_augmented_prompt(
         ) -> str:
     """Construit un prompt enrichi avec contextes RAG et web"""
 
-    rag_context = await perform_rag_search(mode,question,k= 2 if mode=='chat' else 8)
+    k = 2 if mode == 'chat' else 8
 
     if mode == "chat":
-        web_context = await perform_web_search(question)
+        # RAG (Chroma) et recherche web (DDGS) sont indépendants :
+        # les lancer en parallèle
+        web_task = asyncio.create_task(perform_web_search(question))
+        rag_context, rag_score = await perform_rag_search(mode, question, k=k)
+        if WEB_SKIP_THRESHOLD > 0 and rag_score >= WEB_SKIP_THRESHOLD:
+            # Le RAG est déjà confiant : inutile d'attendre DDGS ni de
+            # dépenser des tokens sur des résultats web
+            web_task.cancel()
+            web_context = ""
+            print(f"🔹 Recherche web sautée (score RAG {rag_score:.2f})",
+                  file=sys.stderr)
+        else:
+            web_context = await web_task
+        rag_context = _pack_context(rag_context, CTX_BUDGET)
     else:
+        rag_context, _ = await perform_rag_search(mode, question, k=k)
         web_context = ""
 
     return build_enhanced_prompt(
@@ -407,7 +1275,7 @@ async def _stream_ollama_response(response: httpx.Response, model_name: str):
     async for line in response.aiter_lines():
         if line.strip():
             try:
-                chunk = json.loads(line)
+                chunk = orjson.loads(line)
                 
                 # Construction du message conforme à l'API Ollama
                 message_chunk = {
@@ -425,12 +1293,14 @@ async def _stream_ollama_response(response: httpx.Response, model_name: str):
                     if field in chunk:
                         message_chunk[field] = chunk[field]
                 
-                yield f"data: {json.dumps(message_chunk)}\n\n"
-                
-            except json.JSONDecodeError:
-                yield "event: error\ndata: Invalid JSON chunk\n\n"
-    
-    yield "event: end\ndata: Stream completed\n\n"
+                # orjson.dumps retourne des bytes, acceptés tels quels
+                # par StreamingResponse
+                yield b"data: " + orjson.dumps(message_chunk) + b"\n\n"
+
+            except orjson.JSONDecodeError:
+                yield b"event: error\ndata: Invalid JSON chunk\n\n"
+
+    yield b"event: end\ndata: Stream completed\n\n"
 
 
 # --- Endpoints API ---
@@ -448,38 +1318,63 @@ async def generate_endpoint(request_data: GenerateRequest = Body(...)):
             "options": request_data.options or {}
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{OLLAMA_HOST}/api/generate",
+        if not request_data.stream:
+            # Clé adressée par le contenu complet du payload : même
+            # prompt avec un autre modèle ou d'autres options = autre clé
+            cache_key = _content_key(
+                orjson.dumps(ollama_payload, option=orjson.OPT_SORT_KEYS).decode())
+            # Trois niveaux : mémoire, disque, puis seulement le LLM
+            cached = _answer_mem_get(cache_key)
+            if cached is None:
+                cached = _answer_cache_get(cache_key)
+                if cached is not None:
+                    _answer_mem_put(cache_key, cached)
+            if cached is not None:
+                return Response(content=cached,
+                                media_type="application/json")
+
+            response = await HTTP.post(
+                "/api/generate",
                 json=ollama_payload,
                 timeout=QUERY_TIMEOUT
             )
             response.raise_for_status()
-            
-            if not request_data.stream:
-                return response.json()
-            else:
-                # --- CORRECTION DU STREAMING ---
-                async def generate_stream():
-                    """Générateur pour le streaming des résultats"""
-                    async for chunk in response.aiter_text():
-                        # Transférer directement les chunks
-                        yield chunk
-                        
-                    # Fermeture propre du stream
-                    # yield "data: [DONE]\n\n"
-                
-                # Utilisez text/plain au lieu de text/event-stream
-                return StreamingResponse(
-                    generate_stream(),
-                    media_type="text/plain",
-                    headers={
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "X-Accel-Buffering": "no"
-                    }
-                )
-                        
+            _answer_cache_put(cache_key, response.content)
+            _answer_mem_put(cache_key, response.content)
+            # La réponse est déjà du JSON valide : renvoyer les octets
+            # tels quels plutôt que décoder puis ré-encoder
+            return Response(content=response.content,
+                            media_type="application/json")
+        else:
+            # --- CORRECTION DU STREAMING ---
+            # Le flux amont (octets NDJSON passés tels quels, sans
+            # décodage UTF-8 ni aller-retour JSON par chunk) est ouvert
+            # et son statut vérifié AVANT d'envoyer nos en-têtes : une
+            # erreur Ollama redevient un vrai 500 au lieu d'un 200
+            # tronqué en plein stream
+            req = HTTP.build_request("POST", "/api/generate",
+                                     json=ollama_payload,
+                                     timeout=QUERY_TIMEOUT)
+            response = await HTTP.send(req, stream=True)
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError:
+                await response.aread()
+                await response.aclose()
+                raise
+
+            # Utilisez text/plain au lieu de text/event-stream
+            return StreamingResponse(
+                response.aiter_raw(),
+                media_type="text/plain",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "Connection": "keep-alive",
+                    "X-Accel-Buffering": "no"
+                },
+                background=BackgroundTask(response.aclose)
+            )
+
     except httpx.RequestError as e:
         raise HTTPException(500, f"Erreur de connexion à Ollama: {str(e)}")
     except Exception as e:
@@ -488,14 +1383,25 @@ async def generate_endpoint(request_data: GenerateRequest = Body(...)):
 @app.post("/api/chat")
 async def chat_endpoint(request_data: ChatRequest):
     try:
-        messages = [msg.dict() for msg in request_data.messages]
-        
+        # Seul le contenu du dernier message est modifié : construction
+        # superficielle des autres, sans recopier les images base64
+        msgs = request_data.messages
+        last = len(msgs) - 1
+        messages = [
+            m.model_dump(exclude_none=True) if i == last
+            else {"role": m.role, "content": m.content,
+                  **({"images": m.images} if m.images else {})}
+            for i, m in enumerate(msgs)
+        ]
+
+
         if messages and messages[-1]["role"] == "user":
             original_question = messages[-1]["content"]
             try:
-                # Limiter la taille du contexte
+                # Le contexte est déjà limité au budget de tokens dans
+                # build_augmented_prompt : pas de troncature ici
                 augmented_prompt = await build_augmented_prompt("chat",original_question)
-                messages[-1]["content"] = augmented_prompt[-8000:]  # Truncate to the last 8000 chars
+                messages[-1]["content"] = augmented_prompt
                 print(f"🔹 Prompt enrichi ({len(augmented_prompt)} caractères)", file=sys.stderr)
             except Exception as e:
                 print(f"⚠️ Erreur d'enrichissement: {str(e)}", file=sys.stderr)
@@ -515,91 +1421,105 @@ async def chat_endpoint(request_data: ChatRequest):
             else:
                 ollama_payload["keep_alive"] = request_data.keep_alive
         
-        sopload = json.dumps(ollama_payload, indent=2)
-        print(f" 🔹 Taille du Payload vers Ollama : {len(sopload)} octets...", file=sys.stderr)
-        print(f" 🔹 Début du payload : {sopload}...", file=sys.stderr)
+        if DEBUG_PAYLOAD:
+            sopload = orjson.dumps(ollama_payload, option=orjson.OPT_INDENT_2).decode()
+            print(f" 🔹 Taille du Payload vers Ollama : {len(sopload)} octets...", file=sys.stderr)
+            print(f" 🔹 Début du payload : {sopload}...", file=sys.stderr)
 
         # Appel à Ollama
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    f"{OLLAMA_HOST}/api/chat",
+        try:
+            # Gestion des réponses NON-STREAMING
+            if not request_data.stream:
+                response = await HTTP.post(
+                    "/api/chat",
                     json=ollama_payload,
                     timeout=QUERY_TIMEOUT
                 )
                 response.raise_for_status()
-                
-                # Gestion des réponses NON-STREAMING
-                if not request_data.stream:
-                    return response.json()
-                
-                # --- CORRECTION DU STREAMING ---
-                async def generate_stream():
-                    """Générateur pour le streaming des résultats"""
-                    async for chunk in response.aiter_text():
-                        # Transférer directement les chunks
-                        yield chunk
-                        
-                    # Fermeture propre du stream
-                    # yield "data: [DONE]\n\n"
-                
-                # Utilisez text/plain au lieu de text/event-stream
-                return StreamingResponse(
-                    generate_stream(),
-                    media_type="text/plain",
-                    headers={
-                        "Cache-Control": "no-cache",
-                        "Connection": "keep-alive",
-                        "X-Accel-Buffering": "no"
-                    }
-                )
-    # ... [gestion des erreurs existante] ...
-            except httpx.HTTPStatusError as e:
-                error_detail = e.response.text if e.response else str(e)
-                print(f"🚨 Erreur HTTP Ollama ({e.response.status_code}): {error_detail}", file=sys.stderr)
-                raise HTTPException(502, f"Erreur Ollama: {error_detail}")
-            except httpx.RequestError as e:
-                print(f"🚨 Erreur réseau Ollama: {str(e)}", file=sys.stderr)
-                raise HTTPException(503, f"Ollama non disponible: {str(e)}")
-                
+                return response.json()
+
+            # --- CORRECTION DU STREAMING ---
+            # Le flux amont (octets NDJSON passés tels quels) est ouvert
+            # et son statut vérifié AVANT d'envoyer nos en-têtes : une
+            # erreur Ollama passe par les handlers 502/503 ci-dessous au
+            # lieu de tronquer un 200 en plein stream. La réponse reste
+            # ouverte jusqu'au dernier chunk puis est fermée en tâche de
+            # fond.
+            req = HTTP.build_request("POST", "/api/chat",
+                                     json=ollama_payload,
+                                     timeout=QUERY_TIMEOUT)
+            response = await HTTP.send(req, stream=True)
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError:
+                await response.aread()
+                await response.aclose()
+                raise
+
+            return StreamingResponse(
+                response.aiter_raw(),
+                media_type="application/x-ndjson",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "Connection": "keep-alive",
+                    "X-Accel-Buffering": "no"
+                },
+                background=BackgroundTask(response.aclose)
+            )
+        # ... [gestion des erreurs existante] ...
+        except httpx.HTTPStatusError as e:
+            error_detail = e.response.text if e.response else str(e)
+            print(f"🚨 Erreur HTTP Ollama ({e.response.status_code}): {error_detail}", file=sys.stderr)
+            raise HTTPException(502, f"Erreur Ollama: {error_detail}")
+        except httpx.RequestError as e:
+            print(f"🚨 Erreur réseau Ollama: {str(e)}", file=sys.stderr)
+            raise HTTPException(503, f"Ollama non disponible: {str(e)}")
+
     except Exception as e:
         print(f"🚨 Erreur interne: {traceback.format_exc()}", file=sys.stderr)
         raise HTTPException(500, f"Erreur interne: {str(e)}")
 
+async def _proxy_ollama(method: str, path: str, **kwargs) -> StreamingResponse:
+    """Relaie les octets d'Ollama tels quels, sans parse JSON ni
+    re-sérialisation.
+
+    La réponse amont est ouverte avant de construire la nôtre : son
+    statut est relayé tel quel, et une panne d'Ollama donne une vraie
+    erreur HTTP au lieu d'un 200 tronqué en cours de stream.
+    """
+    try:
+        req = HTTP.build_request(method, path, **kwargs)
+        response = await HTTP.send(req, stream=True)
+    except httpx.RequestError as e:
+        raise HTTPException(500, f"Erreur de connexion à Ollama: {str(e)}")
+    return StreamingResponse(response.aiter_raw(),
+                             status_code=response.status_code,
+                             media_type="application/json",
+                             background=BackgroundTask(response.aclose))
+
 @app.post("/api/embeddings")
 async def embeddings(request: EmbeddingRequest):
     """Proxy direct pour les embeddings"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{OLLAMA_HOST}/api/embeddings",
-                json=request.dict()
-            )
-            response.raise_for_status()
-            return response.json()
-            
-        except httpx.RequestError as e:
-            raise HTTPException(500, f"Erreur de connexion à Ollama: {str(e)}")
+    return await _proxy_ollama("POST", "/api/embeddings", json=request.dict())
 
 @app.get("/api/tags")
 async def list_models():
     """Proxy pour lister les modèles disponibles"""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(f"{OLLAMA_HOST}/api/tags")
-            response.raise_for_status()
-            return response.json()
-            
-        except httpx.RequestError as e:
-            raise HTTPException(500, f"Erreur de connexion à Ollama: {str(e)}")
+    return await _proxy_ollama("GET", "/api/tags")
 
 # Initialisation du vectorstore (à adapter à votre code)
 @app.on_event("startup")
 async def startup_event():
     global vectorstore
-    build_vectorstore()
+    await build_vectorstore()
+    _load_sem_cache()  # après build : le hash du code est connu
     print("🔹 Initialisation du serveur proxy Ollama+RAG")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    _save_sem_cache()
+    await HTTP.aclose()
+
 # Endpoint supplémentaire pour le contrôle
 @app.get("/control/enable_web_search")
 async def enable_web_search(enabled: bool = True):
@@ -607,6 +1527,12 @@ async def enable_web_search(enabled: bool = True):
     DDGS_SEARCH_ENABLED = enabled
     return {"status": "success", "web_search_enabled": enabled}
 
+@app.get("/control/reload")
+async def reload_vectorstore():
+    """Revérifie le hash du code et reconstruit l'index si besoin"""
+    await build_vectorstore(force=True)
+    return {"status": "success", "code_hash": code_hash}
+
 # Endpoint de debug simplifié
 @app.post("/debug")
 async def debug_endpoint(request: Request):
@@ -1,146 +1,188 @@
 #!/usr/bin/env python3
 """
 Fake Qobuz server for debugging
-Logs all incoming requests with full details
+Logs all incoming requests with full details (pass --debug to enable)
 """
 
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import asyncio
 import json
+import sys
 import urllib.parse
 from datetime import datetime
 
-class FakeQobuzHandler(BaseHTTPRequestHandler):
-    def log_request_details(self, method):
-        """Log complete request details"""
-        timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-
-        print(f"\n{'='*80}")
-        print(f"[{timestamp}] {method} {self.path}")
-        print(f"{'='*80}")
-
-        # Parse URL
-        parsed = urllib.parse.urlparse(self.path)
-        print(f"\nURL Components:")
-        print(f"  Path: {parsed.path}")
-        print(f"  Query: {parsed.query}")
-
-        if parsed.query:
-            params = urllib.parse.parse_qs(parsed.query)
-            print(f"\nQuery Parameters:")
+try:
+    import orjson
+    def _dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+# Verbose request logging costs parse_qs + sorted prints per request:
+# off by default so replay runs only measure the client under test
+DEBUG = False
+
+def log_request_details(method, path, headers, body):
+    """Log complete request details"""
+    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+    print(f"\n{'='*80}")
+    print(f"[{timestamp}] {method} {path}")
+    print(f"{'='*80}")
+
+    # Parse URL
+    parsed = urllib.parse.urlparse(path)
+    print(f"\nURL Components:")
+    print(f"  Path: {parsed.path}")
+    print(f"  Query: {parsed.query}")
+
+    if parsed.query:
+        params = urllib.parse.parse_qs(parsed.query)
+        print(f"\nQuery Parameters:")
+        for key, values in sorted(params.items()):
+            print(f"  {key}: {values[0]}")
+
+    # Headers
+    print(f"\nHeaders:")
+    for header, value in sorted(headers.items()):
+        print(f"  {header}: {value}")
+
+    # Body for POST
+    if method == "POST" and body:
+        print(f"\nBody (raw): {body}")
+
+        content_type = headers.get('content-type', '')
+        if 'application/x-www-form-urlencoded' in content_type:
+            params = urllib.parse.parse_qs(body.decode('utf-8'))
+            print(f"\nForm Data:")
             for key, values in sorted(params.items()):
                 print(f"  {key}: {values[0]}")
-
-        # Headers
-        print(f"\nHeaders:")
-        for header, value in sorted(self.headers.items()):
-            print(f"  {header}: {value}")
-
-        # Body for POST
-        if method == "POST":
-            content_length = int(self.headers.get('Content-Length', 0))
-            if content_length > 0:
-                body = self.rfile.read(content_length)
-                print(f"\nBody (raw): {body}")
-
-                content_type = self.headers.get('Content-Type', '')
-                if 'application/x-www-form-urlencoded' in content_type:
-                    params = urllib.parse.parse_qs(body.decode('utf-8'))
-                    print(f"\nForm Data:")
-                    for key, values in sorted(params.items()):
-                        print(f"  {key}: {values[0]}")
-                elif 'application/json' in content_type:
-                    try:
-                        data = json.loads(body.decode('utf-8'))
-                        print(f"\nJSON Data:")
-                        print(f"  {json.dumps(data, indent=2)}")
-                    except:
-                        pass
-
-        print(f"\n{'='*80}\n")
-
-    def do_GET(self):
-        self.log_request_details("GET")
-        self.send_fake_response()
-
-    def do_POST(self):
-        self.log_request_details("POST")
-        self.send_fake_response()
-
-    def send_fake_response(self):
-        """Send a fake successful response"""
-        path = urllib.parse.urlparse(self.path).path
-
-        # Login response
-        if '/user/login' in path:
-            response = {
-                "user": {
-                    "id": "1217710",
-                    "credential": {
-                        "parameters": {
-                            "short_label": "Studio"
-                        }
-                    }
-                },
-                "user_auth_token": "FAKE_TOKEN_12345"
-            }
-
-        # Favorite albums
-        elif '/favorite/getUserFavorites' in path:
-            response = {
-                "albums": {
-                    "total": 1,
-                    "items": [{
-                        "id": "0825646206179",
-                        "title": "Under the Shade of Violets",
-                        "artist": {"name": "Orange Blossom"}
-                    }]
+        elif 'application/json' in content_type:
+            try:
+                data = json.loads(body.decode('utf-8'))
+                print(f"\nJSON Data:")
+                print(f"  {json.dumps(data, indent=2)}")
+            except:
+                pass
+
+    print(f"\n{'='*80}\n")
+
+# Les réponses sont constantes : sérialisées une seule fois à l'import,
+# le chemin chaud se réduit à un lookup dans la table de dispatch
+_RESPONSES = {
+    # Login response
+    '/user/login': _dumps({
+        "user": {
+            "id": "1217710",
+            "credential": {
+                "parameters": {
+                    "short_label": "Studio"
                 }
             }
-
-        # Album get
-        elif '/album/get' in path:
-            response = {
-                "tracks": {
-                    "items": [{
-                        "id": "12345678",
-                        "title": "Test Track"
-                    }]
-                }
-            }
-
-        # Track getFileUrl
-        elif '/track/getFileUrl' in path:
-            response = {
-                "url": "https://fake.qobuz.com/track.flac",
-                "mime_type": "audio/flac",
-                "sampling_rate": 44.1,
-                "bit_depth": 16,
-                "format_id": 27
-            }
-
-        else:
-            response = {"status": "ok"}
-
-        # Send response
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(response).encode('utf-8'))
-
-    def log_message(self, format, *args):
-        """Suppress default logging"""
+        },
+        "user_auth_token": "FAKE_TOKEN_12345"
+    }),
+
+    # Favorite albums
+    '/favorite/getUserFavorites': _dumps({
+        "albums": {
+            "total": 1,
+            "items": [{
+                "id": "0825646206179",
+                "title": "Under the Shade of Violets",
+                "artist": {"name": "Orange Blossom"}
+            }]
+        }
+    }),
+
+    # Album get
+    '/album/get': _dumps({
+        "tracks": {
+            "items": [{
+                "id": "12345678",
+                "title": "Test Track"
+            }]
+        }
+    }),
+
+    # Track getFileUrl
+    '/track/getFileUrl': _dumps({
+        "url": "https://fake.qobuz.com/track.flac",
+        "mime_type": "audio/flac",
+        "sampling_rate": 44.1,
+        "bit_depth": 16,
+        "format_id": 27
+    }),
+}
+
+_DEFAULT_RESPONSE = _dumps({"status": "ok"})
+
+def fake_response(path):
+    """Pick the pre-serialized response for the requested endpoint"""
+    path = urllib.parse.urlparse(path).path
+    for endpoint, payload in _RESPONSES.items():
+        if endpoint in path:
+            return payload
+    return _DEFAULT_RESPONSE
+
+async def handle_client(reader, writer):
+    """Serve one connection (keep-alive: loop until the peer closes)"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line or request_line in (b'\r\n', b'\n'):
+                break
+            try:
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', 0) or 0)
+            body = await reader.readexactly(length) if length else b''
+
+            if DEBUG:
+                log_request_details(method, path, headers, body)
+
+            payload = fake_response(path)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: " + str(len(payload)).encode('ascii') +
+                b"\r\n\r\n" + payload
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
         pass
-
-def run_server(port=8080):
-    server = HTTPServer(('localhost', port), FakeQobuzHandler)
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+
+async def run_server(port=8080):
+    server = await asyncio.start_server(handle_client, 'localhost', port)
     print(f"🎭 Fake Qobuz Server running on http://localhost:{port}")
-    print(f"   Logging all requests to console...")
+    if DEBUG:
+        print(f"   Logging all requests to console...")
+    else:
+        print(f"   Request logging off (pass --debug to enable)")
     print(f"   Press Ctrl+C to stop\n")
 
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    DEBUG = "--debug" in sys.argv
     try:
-        server.serve_forever()
+        asyncio.run(run_server())
     except KeyboardInterrupt:
         print("\n\n✓ Server stopped")
-
-if __name__ == "__main__":
-    run_server()
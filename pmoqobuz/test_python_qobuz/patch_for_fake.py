@@ -3,42 +3,53 @@
 Patch raw.py to use fake server
 """
 
+import os
+import re
 import sys
+import tempfile
 
-def patch_raw_py():
-    """Replace base URL in raw.py"""
-    with open('raw.py', 'r') as f:
+# Les deux formes de la ligne, pré-compilées en motifs bytes : une
+# seule passe subn par réécriture, sans test `in` préalable
+_REAL_LINE = b'self.baseUrl = "https://www.qobuz.com/api.json/"'
+_FAKE_LINE = b'self.baseUrl = "http://localhost:8080/api.json/"'
+_REAL_RE = re.compile(re.escape(_REAL_LINE))
+_FAKE_RE = re.compile(re.escape(_FAKE_LINE))
+
+def _rewrite(pattern, replacement):
+    """Substitue dans raw.py ; écriture atomique (temp + os.replace).
+
+    Retourne le nombre de substitutions effectuées (0 = rien à faire,
+    le fichier n'est pas touché).
+    """
+    with open('raw.py', 'rb') as f:
         content = f.read()
 
-    # Replace base URL (without version, as it's constructed dynamically)
-    original_line = 'self.baseUrl = "https://www.qobuz.com/api.json/"'
-    fake_line = 'self.baseUrl = "http://localhost:8080/api.json/"'
+    new_content, count = pattern.subn(replacement, content)
+    if count:
+        fd, tmp = tempfile.mkstemp(dir='.', prefix='raw.py.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(new_content)
+        # mkstemp crée le fichier en 0600 : recopier le mode d'origine
+        # pour que os.replace ne change pas les permissions de raw.py
+        os.chmod(tmp, os.stat('raw.py').st_mode)
+        os.replace(tmp, 'raw.py')
+    return count
 
-    if original_line in content:
-        content = content.replace(original_line, fake_line)
-        with open('raw.py', 'w') as f:
-            f.write(content)
+def patch_raw_py():
+    """Replace base URL in raw.py"""
+    if _rewrite(_REAL_RE, _FAKE_LINE):
         print(f"✓ Patched raw.py:")
-        print(f"  {original_line}")
-        print(f"  → {fake_line}")
+        print(f"  {_REAL_LINE.decode()}")
+        print(f"  → {_FAKE_LINE.decode()}")
         return True
     else:
         print("✗ Original URL not found in raw.py")
-        print("   Looking for:", original_line)
+        print("   Looking for:", _REAL_LINE.decode())
         return False
 
 def unpatch_raw_py():
     """Restore original URL in raw.py"""
-    with open('raw.py', 'r') as f:
-        content = f.read()
-
-    original_line = 'self.baseUrl = "https://www.qobuz.com/api.json/"'
-    fake_line = 'self.baseUrl = "http://localhost:8080/api.json/"'
-
-    if fake_line in content:
-        content = content.replace(fake_line, original_line)
-        with open('raw.py', 'w') as f:
-            f.write(content)
+    if _rewrite(_FAKE_RE, _REAL_LINE):
         print(f"✓ Restored raw.py to original URL")
         return True
     else:
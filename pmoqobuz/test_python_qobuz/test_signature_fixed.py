@@ -9,6 +9,26 @@ import sys
 sys.path.insert(0, '.')
 from spoofbuz import Spoofer
 
+# Morceaux fixes de la chaîne à signer, pré-encodés une fois : la
+# signature se calcule alors en updates MD5 successifs, sans concaténer
+# de grande chaîne intermédiaire
+_PREFIX = b"trackgetFileUrlformat_id"
+_MID1 = b"intent"
+_MID2 = b"track_id"
+
+def compute_signature(format_id, intent, track_id, timestamp, app_secret_bytes):
+    """Même logique que raw.py, en flux d'updates sur des bytes"""
+    m = hashlib.md5()
+    m.update(_PREFIX)
+    m.update(format_id.encode("ascii"))
+    m.update(_MID1)
+    m.update(intent.encode("ascii"))
+    m.update(_MID2)
+    m.update(track_id.encode("ascii"))
+    m.update(timestamp.encode("ascii"))
+    m.update(app_secret_bytes)
+    return m.hexdigest()
+
 def main():
     print("=== Test de signature MD5 (Python) ===\n")
 
@@ -35,17 +55,10 @@ def main():
     print(f"   timestamp: {timestamp}")
     print(f"   secret: {app_secret[:10]}... (first 10 chars)")
 
-    # Calculer la signature (même logique que raw.py)
-    stringvalue = (
-        "trackgetFileUrlformat_id" + format_id +
-        "intent" + intent +
-        "track_id" + track_id +
-        timestamp
-    )
-    stringvalue = stringvalue.encode("ASCII")
-    stringvalue += app_secret.encode("utf-8")
-
-    signature = hashlib.md5(stringvalue).hexdigest()
+    # Secret encodé une seule fois, réutilisé pour chaque signature
+    app_secret_bytes = app_secret.encode("utf-8")
+    signature = compute_signature(format_id, intent, track_id,
+                                  timestamp, app_secret_bytes)
 
     print("\n3. Result:")
     print(f"   Signature: {signature}")
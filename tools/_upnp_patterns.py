@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Motifs UPnP partagés par les outils de debug
+
+Compilés une seule fois à l'import ; motifs bytes pour travailler sur
+les payloads bruts sans les décoder en entier.
+"""
+
+import re
+
+# Champs de la description de device (replis regex des parsers XML)
+FRIENDLY_NAME_RE = re.compile(rb'<friendlyName>([^<]+)</friendlyName>')
+MANUFACTURER_RE = re.compile(rb'<manufacturer>([^<]+)</manufacturer>')
+MODEL_NAME_RE = re.compile(rb'<modelName>([^<]+)</modelName>')
+UDN_RE = re.compile(rb'<UDN>([^<]+)</UDN>')
+SERVICE_TYPE_RE = re.compile(rb'<serviceType>([^<]+)</serviceType>')
+ICONLIST_RE = re.compile(rb'<iconList>')
+
+# Alternation de branches nommées : balaye une description complète en
+# un seul passage au lieu de huit recherches séparées. Aucune branche ne
+# contient de `.` ; specVersion utilise \s* (qui couvre les sauts de
+# ligne) au lieu d'un .*? paresseux
+FIELDS_RE = re.compile(
+    rb'<deviceType>(?P<deviceType>[^<]+)</deviceType>'
+    rb'|<friendlyName>(?P<friendlyName>[^<]+)</friendlyName>'
+    rb'|<manufacturer>(?P<manufacturer>[^<]+)</manufacturer>'
+    rb'|<modelName>(?P<modelName>[^<]+)</modelName>'
+    rb'|<UDN>(?P<UDN>[^<]+)</UDN>'
+    rb'|<serviceType>(?P<serviceType>[^<]+)</serviceType>'
+    rb'|<specVersion>\s*<major>(?P<major>\d+)</major>\s*<minor>(?P<minor>\d+)</minor>'
+    rb'|(?P<iconList><iconList>)'
+)
+
+# Noms d'actions d'un SCPD (repli regex de l'iterparse)
+ACTION_NAME_RE = re.compile(r'<action>.*?<name>([^<]+)</name>', re.DOTALL)
+
+# En-têtes SSDP extraits en un seul balayage du datagramme brut
+SSDP_HEADER_RE = re.compile(rb'^(location|server|st|usn):\s*(.+?)\r?$',
+                            re.IGNORECASE | re.MULTILINE)
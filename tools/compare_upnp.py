@@ -3,8 +3,17 @@
 Compare UPnP MediaServers
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 from urllib.request import urlopen, Request
-import re
+import hashlib
+import io
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from _upnp_patterns import FIELDS_RE
 
 # Devices à comparer
 DEVICES = {
@@ -14,47 +23,109 @@ DEVICES = {
     "Freebox": "http://192.168.0.254:52424/device.xml",
 }
 
+# Ordre des colonnes et gabarit de ligne du tableau comparatif,
+# construits une seule fois : les largeurs se changent à un seul endroit
+DEV_ORDER = list(DEVICES)
+ROW_FMT = "{:<20} | " + " | ".join(["{:<30}"] * len(DEV_ORDER))
+
+# Les descriptions sont stables pendant une session de debug : un petit
+# cache disque évite de re-télécharger à chaque relance du script
+_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pmomusic")
+_CACHE_TTL = 60  # secondes
+_USE_CACHE = "--no-cache" not in sys.argv
+
+def _cache_path(url):
+    return os.path.join(_CACHE_DIR, hashlib.md5(url.encode()).hexdigest() + ".xml")
+
 def fetch_description(url):
-    """Récupère la description XML"""
+    """Récupère la description XML (bytes bruts, décodés à l'affichage)"""
+    path = _cache_path(url)
+
+    if _USE_CACHE:
+        try:
+            if time.time() - os.path.getmtime(path) < _CACHE_TTL:
+                with open(path, 'rb') as f:
+                    return f.read()
+        except OSError:
+            pass  # pas encore en cache
+
     try:
         req = Request(url, headers={'User-Agent': 'PMOMusic/1.0'})
         response = urlopen(req, timeout=3)
-        return response.read().decode('utf-8')
+        xml = response.read()
     except Exception as e:
         return f"Error: {e}"
 
+    if _USE_CACHE:
+        try:
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(xml)
+        except OSError:
+            pass  # cache en lecture seule : tant pis
+
+    return xml
+
+def _extract_info_tree(xml):
+    """Une seule passe expat sur le document au lieu de huit balayages
+    regex ; les namespaces sont ignorés sur le nom de balise"""
+    root = ET.fromstring(xml)
+    info = {}
+    services = []
+    major = minor = None
+    has_icons = False
+
+    for el in root.iter():
+        tag = el.tag.rpartition('}')[2]
+        if tag in ('deviceType', 'friendlyName', 'manufacturer',
+                   'modelName', 'UDN'):
+            info.setdefault(tag, (el.text or '').strip())
+        elif tag == 'major' and major is None:
+            major = (el.text or '').strip()
+        elif tag == 'minor' and minor is None:
+            minor = (el.text or '').strip()
+        elif tag == 'serviceType':
+            services.append((el.text or '').strip())
+        elif tag == 'iconList':
+            has_icons = True
+
+    if major and minor:
+        info['specVersion'] = f"{major}.{minor}"
+    info['services'] = services
+    info['hasIcons'] = has_icons
+    return info
+
 def extract_info(xml):
     """Extrait les infos clés"""
+    try:
+        return _extract_info_tree(xml)
+    except ET.ParseError:
+        pass  # XML mal formé : repli sur les regex, plus tolérantes
+
     info = {}
+    services = []
+    has_icons = False
+
+    # La branche qui a matché est identifiée par son nom de groupe ;
+    # setdefault conserve la première occurrence, comme search
+    for match in FIELDS_RE.finditer(xml):
+        key = match.lastgroup
+        if key == 'serviceType':
+            services.append(match.group(key).decode('utf-8', errors='ignore'))
+        elif key == 'iconList':
+            has_icons = True
+        elif key == 'minor':
+            spec = f"{match.group('major').decode()}.{match.group('minor').decode()}"
+            info.setdefault('specVersion', spec)
+        else:
+            info.setdefault(key, match.group(key).decode('utf-8', errors='ignore'))
 
-    patterns = {
-        'deviceType': r'<deviceType>([^<]+)</deviceType>',
-        'friendlyName': r'<friendlyName>([^<]+)</friendlyName>',
-        'manufacturer': r'<manufacturer>([^<]+)</manufacturer>',
-        'modelName': r'<modelName>([^<]+)</modelName>',
-        'UDN': r'<UDN>([^<]+)</UDN>',
-        'specVersion': r'<specVersion>.*?<major>(\d+)</major>.*?<minor>(\d+)</minor>',
-    }
-
-    for key, pattern in patterns.items():
-        match = re.search(pattern, xml, re.DOTALL)
-        if match:
-            if key == 'specVersion':
-                info[key] = f"{match.group(1)}.{match.group(2)}"
-            else:
-                info[key] = match.group(1)
-
-    # Extraire les services
-    services = re.findall(r'<serviceType>([^<]+)</serviceType>', xml)
     info['services'] = services
-
-    # Vérifier les icônes
-    has_icons = bool(re.search(r'<iconList>', xml))
     info['hasIcons'] = has_icons
 
     return info
 
-def main():
+def _run_comparison():
     print("=" * 100)
     print(" 🔍 UPnP MediaServer Comparison")
     print("=" * 100)
@@ -62,11 +133,15 @@ def main():
 
     results = {}
 
-    for name, url in DEVICES.items():
+    # Les quatre requêtes HTTP sont indépendantes : on les lance en
+    # parallèle pour ne payer qu'une seule fois la latence réseau
+    with ThreadPoolExecutor(max_workers=len(DEVICES)) as executor:
+        xmls = dict(zip(DEVICES, executor.map(fetch_description, DEVICES.values())))
+
+    for name, xml in xmls.items():
         print(f"📡 Fetching {name}...")
-        xml = fetch_description(url)
 
-        if not xml.startswith("Error"):
+        if not isinstance(xml, str):
             results[name] = {
                 'xml': xml,
                 'info': extract_info(xml)
@@ -83,20 +158,16 @@ def main():
     print()
 
     # Tableau comparatif
-    print(f"{'Property':<20} | {'PMO Music 1':<30} | {'PMO Music 2':<30} | {'Upmpdcli':<30} | {'Freebox':<30}")
+    print(ROW_FMT.format('Property', *DEV_ORDER))
     print("-" * 150)
 
     properties = ['deviceType', 'specVersion', 'UDN', 'friendlyName', 'manufacturer', 'modelName', 'hasIcons']
 
     for prop in properties:
-        row = f"{prop:<20} |"
-        for device in ["PMO Music 1", "PMO Music 2", "Upmpdcli", "Freebox"]:
-            if device in results:
-                value = str(results[device]['info'].get(prop, 'N/A'))[:28]
-                row += f" {value:<30} |"
-            else:
-                row += f" {'N/A':<30} |"
-        print(row)
+        print(ROW_FMT.format(prop, *(
+            str(results[device]['info'].get(prop, 'N/A'))[:28]
+            if device in results else 'N/A'
+            for device in DEV_ORDER)))
 
     print()
     print("=" * 100)
@@ -118,13 +189,13 @@ def main():
         print("\n" + "=" * 50)
         print(" PMO Music MediaServer XML:")
         print("=" * 50)
-        print(results["PMO Music 1"]['xml'])
+        print(results["PMO Music 1"]['xml'].decode('utf-8', errors='ignore'))
 
     if "Upmpdcli" in results:
         print("\n" + "=" * 50)
         print(" Upmpdcli (WORKING) XML:")
         print("=" * 50)
-        print(results["Upmpdcli"]['xml'])
+        print(results["Upmpdcli"]['xml'].decode('utf-8', errors='ignore'))
 
     # Analyse des différences critiques
     print("\n" + "=" * 100)
@@ -162,5 +233,13 @@ def main():
         if not pmo_icons and upmp_icons:
             print(f"  ⚠️  PMO Music n'a pas d'iconList (mais peut ne pas être critique)")
 
+def main():
+    # Tout le rapport est accumulé en mémoire puis émis en une seule
+    # écriture : un syscall au lieu d'un par print
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        _run_comparison()
+    sys.stdout.write(buffer.getvalue())
+
 if __name__ == "__main__":
     main()
@@ -4,13 +4,18 @@ UPnP Device Discovery Tool
 Envoie une requête M-SEARCH SSDP et collecte les réponses des devices
 """
 
+import selectors
 import socket
 import struct
 import time
 import sys
+import xml.etree.ElementTree as ET
 from urllib.parse import urlparse
 from urllib.request import urlopen
 
+from _upnp_patterns import (FRIENDLY_NAME_RE, MANUFACTURER_RE,
+                            MODEL_NAME_RE, UDN_RE, SSDP_HEADER_RE)
+
 SSDP_ADDR = "239.255.255.250"
 SSDP_PORT = 1900
 SSDP_MX = 3
@@ -25,69 +30,139 @@ USER-AGENT: PMOMusic UPnP Discovery Tool
 
 """
 
+# Datagramme encodé une seule fois à l'import
+_M_SEARCH_BYTES = M_SEARCH.replace('\n', '\r\n').encode('ascii')
+
+def _local_ip():
+    """Adresse IP de l'interface de sortie vers le groupe multicast
+    (socket connecté jetable : aucun trafic n'est émis)"""
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        probe.connect((SSDP_ADDR, SSDP_PORT))
+        return probe.getsockname()[0]
+    except OSError:
+        return None
+    finally:
+        probe.close()
+
 def discover_upnp_devices(timeout=5):
     """Découvre les devices UPnP sur le réseau local"""
 
     devices = {}
 
-    # Créer le socket UDP
+    # Créer le socket UDP en mode non bloquant : les réponses sont
+    # drainées par rafales via epoll plutôt qu'un recvfrom bloquant
+    # par paquet
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.settimeout(timeout)
+    sock.setblocking(False)
 
-    # Envoyer la requête M-SEARCH
+    # TTL court (le réseau local suffit) et interface de sortie fixée :
+    # le noyau ne reconsulte pas la table de routage à chaque envoi
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', 2))
+    local_ip = _local_ip()
+    if local_ip:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                        socket.inet_aton(local_ip))
+
+    # Bind explicite : le port source est choisi une seule fois
+    sock.bind(('0.0.0.0', 0))
+
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+
+    # Envoyer la requête M-SEARCH (répétée comme le recommande la spec
+    # UPnP : les datagrammes UDP peuvent se perdre)
     print(f"🔍 Envoi de la requête M-SEARCH sur {SSDP_ADDR}:{SSDP_PORT}...")
     print(f"⏱️  Timeout: {timeout}s\n")
 
-    message = M_SEARCH.replace('\n', '\r\n').encode('utf-8')
-    sock.sendto(message, (SSDP_ADDR, SSDP_PORT))
-
     # Collecter les réponses
     start_time = time.time()
+    sends_left = 3
+    next_send = start_time
 
-    while time.time() - start_time < timeout:
-        try:
-            data, addr = sock.recvfrom(65507)
-            response = data.decode('utf-8', errors='ignore')
-
-            # Parser la réponse
-            location = None
-            server = None
-            st = None
-            usn = None
-
-            for line in response.split('\r\n'):
-                if line.lower().startswith('location:'):
-                    location = line.split(':', 1)[1].strip()
-                elif line.lower().startswith('server:'):
-                    server = line.split(':', 1)[1].strip()
-                elif line.lower().startswith('st:'):
-                    st = line.split(':', 1)[1].strip()
-                elif line.lower().startswith('usn:'):
-                    usn = line.split(':', 1)[1].strip()
+    while True:
+        now = time.time()
+        if now - start_time >= timeout:
+            break
+
+        if sends_left and now >= next_send:
+            sock.sendto(_M_SEARCH_BYTES, (SSDP_ADDR, SSDP_PORT))
+            sends_left -= 1
+            next_send = now + 1.0
+
+        wait = timeout - (now - start_time)
+        if sends_left:
+            wait = min(wait, next_send - now)
+
+        if not selector.select(max(wait, 0)):
+            continue
+
+        # Drainer toutes les réponses déjà arrivées
+        while True:
+            try:
+                data, addr = sock.recvfrom(65507)
+            except BlockingIOError:
+                break
+            except Exception as e:
+                print(f"⚠️  Erreur lors de la réception: {e}")
+                break
+
+            # Parser la réponse : un seul passage du moteur regex sur
+            # les octets bruts au lieu d'une boucle Python par ligne
+            fields = {m.group(1).lower(): m.group(2).strip()
+                      for m in SSDP_HEADER_RE.finditer(data)}
+
+            location = fields.get(b'location')
+            if location:
+                location = location.decode('utf-8', errors='ignore')
+
+            def _text(key):
+                value = fields.get(key)
+                return value.decode('utf-8', errors='ignore') if value else None
 
             if location and location not in devices:
                 devices[location] = {
                     'location': location,
-                    'server': server,
-                    'st': st,
-                    'usn': usn,
+                    'server': _text(b'server'),
+                    'st': _text(b'st'),
+                    'usn': _text(b'usn'),
                     'from': addr[0]
                 }
 
-        except socket.timeout:
-            break
-        except Exception as e:
-            print(f"⚠️  Erreur lors de la réception: {e}")
-
+    selector.close()
     sock.close()
     return devices
 
+def extract_device_fields(desc):
+    """Extrait les champs importants de la description.
+
+    Une seule passe expat sur le document ; repli sur les regex si le
+    XML est mal formé."""
+    fields = {}
+    try:
+        root = ET.fromstring(desc)
+    except ET.ParseError:
+        for key, pattern in (('friendlyName', FRIENDLY_NAME_RE),
+                             ('manufacturer', MANUFACTURER_RE),
+                             ('modelName', MODEL_NAME_RE),
+                             ('UDN', UDN_RE)):
+            match = pattern.search(desc)
+            if match:
+                fields[key] = match.group(1).decode('utf-8', errors='ignore')
+        return fields
+
+    for el in root.iter():
+        tag = el.tag.rpartition('}')[2]
+        if tag in ('friendlyName', 'manufacturer', 'modelName', 'UDN'):
+            fields.setdefault(tag, (el.text or '').strip())
+    return fields
+
 def fetch_device_description(location):
-    """Récupère la description XML du device"""
+    """Récupère la description XML du device (bytes bruts)"""
     try:
         response = urlopen(location, timeout=3)
-        return response.read().decode('utf-8')
+        return response.read()
     except Exception as e:
         return f"Error: {e}"
 
@@ -134,11 +209,11 @@ def main():
         desc = fetch_device_description(location)
 
         # Analyser la description
-        if desc and not desc.startswith("Error"):
+        if desc and not isinstance(desc, str):
             print("\n📝 Device Description XML:")
             print("-" * 70)
-            # Afficher les premières lignes
-            lines = desc.split('\n')
+            # Afficher les premières lignes (seul l'affichage décode)
+            lines = desc.decode('utf-8', errors='ignore').split('\n')
             for line in lines[:50]:  # Limiter à 50 lignes
                 print(line)
             if len(lines) > 50:
@@ -146,25 +221,20 @@ def main():
             print("-" * 70)
 
             # Extraire les infos importantes
-            import re
-            friendly_name = re.search(r'<friendlyName>([^<]+)</friendlyName>', desc)
-            manufacturer = re.search(r'<manufacturer>([^<]+)</manufacturer>', desc)
-            model_name = re.search(r'<modelName>([^<]+)</modelName>', desc)
-            udn = re.search(r'<UDN>([^<]+)</UDN>', desc)
+            fields = extract_device_fields(desc)
 
             print("\n📋 Device Info:")
-            if friendly_name:
-                print(f"   Friendly Name: {friendly_name.group(1)}")
-            if manufacturer:
-                print(f"   Manufacturer:  {manufacturer.group(1)}")
-            if model_name:
-                print(f"   Model Name:    {model_name.group(1)}")
-            if udn:
-                print(f"   UDN:           {udn.group(1)}")
+            if 'friendlyName' in fields:
+                print(f"   Friendly Name: {fields['friendlyName']}")
+            if 'manufacturer' in fields:
+                print(f"   Manufacturer:  {fields['manufacturer']}")
+            if 'modelName' in fields:
+                print(f"   Model Name:    {fields['modelName']}")
+            if 'UDN' in fields:
+                print(f"   UDN:           {fields['UDN']}")
 
                 # Vérifier le format de l'UDN
-                udn_value = udn.group(1)
-                if not udn_value.startswith('uuid:'):
+                if not fields['UDN'].startswith('uuid:'):
                     print(f"   ⚠️  WARNING: UDN ne commence pas par 'uuid:' !")
         else:
             print(f"❌ Erreur lors de la récupération: {desc}")
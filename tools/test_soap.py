@@ -3,7 +3,15 @@
 Test SOAP Services for UPnP MediaServers
 """
 
-from urllib.request import Request, urlopen
+import http.client
+import io
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from urllib.parse import urlparse
+
+from _upnp_patterns import ACTION_NAME_RE
 
 # SOAP request pour GetProtocolInfo
 GET_PROTOCOL_INFO = """<?xml version="1.0" encoding="utf-8"?>
@@ -28,6 +36,10 @@ BROWSE_REQUEST = """<?xml version="1.0" encoding="utf-8"?>
   </s:Body>
 </s:Envelope>"""
 
+# Corps SOAP encodés une seule fois à l'import
+_GET_PROTOCOL_INFO_BYTES = GET_PROTOCOL_INFO.encode('utf-8')
+_BROWSE_REQUEST_BYTES = BROWSE_REQUEST.encode('utf-8')
+
 SERVERS = {
     "PMO Music": {
         "base": "http://192.168.0.138:8080",
@@ -43,52 +55,122 @@ SERVERS = {
     },
 }
 
+def extract_scpd_actions(scpd_xml):
+    """Extrait les noms d'actions du SCPD en un seul passage expat
+    (les <name> des <argument> sont ignorés grâce à la pile de balises) ;
+    repli sur la regex si le XML est mal formé"""
+    try:
+        actions = []
+        stack = []
+        for event, el in ET.iterparse(io.StringIO(scpd_xml),
+                                      events=('start', 'end')):
+            tag = el.tag.rpartition('}')[2]
+            if event == 'start':
+                stack.append(tag)
+            else:
+                stack.pop()
+                if tag == 'name' and stack and stack[-1] == 'action':
+                    actions.append((el.text or '').strip())
+                el.clear()
+        return actions
+    except ET.ParseError:
+        return ACTION_NAME_RE.findall(scpd_xml)
+
+def open_connection(base):
+    """Ouvre une connexion HTTP vers le serveur"""
+    parsed = urlparse(base)
+    return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=5)
+
 def send_soap_request(url, soap_action, soap_body):
-    """Envoie une requête SOAP"""
+    """Envoie une requête SOAP (soap_body est déjà encodé en bytes ; la
+    réponse est renvoyée brute, seule la tranche affichée sera décodée).
+
+    Une connexion par requête : les appels d'un même serveur partent en
+    parallèle sur des sockets distincts, il n'y a donc rien à réutiliser
+    entre deux requêtes."""
+    parsed = urlparse(url)
     try:
-        req = Request(
-            url,
-            data=soap_body.encode('utf-8'),
-            headers={
-                'Content-Type': 'text/xml; charset="utf-8"',
-                'SOAPAction': f'"{soap_action}"',
-                'User-Agent': 'PMOMusic/1.0',
-            }
-        )
-        response = urlopen(req, timeout=5)
-        return response.read().decode('utf-8'), response.status, dict(response.headers)
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80,
+                                          timeout=5)
+        try:
+            conn.request(
+                'POST',
+                parsed.path,
+                body=soap_body,
+                headers={
+                    'Content-Type': 'text/xml; charset="utf-8"',
+                    'SOAPAction': f'"{soap_action}"',
+                    'User-Agent': 'PMOMusic/1.0',
+                }
+            )
+            response = conn.getresponse()
+            # Seul le Content-Type intéresse l'appelant : inutile de
+            # copier tous les en-têtes dans un dict
+            return response.read(), response.status, response.getheader('Content-Type')
+        finally:
+            conn.close()
     except Exception as e:
         return f"Error: {e}", None, None
 
-def main():
+def fetch_scpd(server_info):
+    """Récupère la description SCPD du ContentDirectory"""
+    try:
+        conn = open_connection(server_info["base"])
+        conn.request('GET', server_info["scpd_content"],
+                     headers={'User-Agent': 'PMOMusic/1.0'})
+        response = conn.getresponse()
+        scpd_xml = response.read().decode('utf-8')
+        conn.close()
+        return scpd_xml
+    except Exception as e:
+        return f"Error: {e}"
+
+def _run_tests():
     print("=" * 100)
     print(" 🧪 SOAP Services Testing")
     print("=" * 100)
     print()
 
+    scpd_results = {}
+
     for server_name, server_info in SERVERS.items():
         print("\n" + "=" * 100)
         print(f" 📡 Testing {server_name}")
         print("=" * 100)
 
+        # Les trois requêtes du serveur sont indépendantes : on les
+        # lance de front et on affiche les résultats dans l'ordre fixe
+        # des tests
+        proto_action = "urn:schemas-upnp-org:service:ConnectionManager:1#GetProtocolInfo"
+        browse_action = "urn:schemas-upnp-org:service:ContentDirectory:1#Browse"
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            proto_future = executor.submit(
+                send_soap_request,
+                server_info["base"] + server_info["conn_control"],
+                proto_action, _GET_PROTOCOL_INFO_BYTES)
+            browse_future = executor.submit(
+                send_soap_request,
+                server_info["base"] + server_info["content_control"],
+                browse_action, _BROWSE_REQUEST_BYTES)
+            scpd_future = executor.submit(fetch_scpd, server_info)
+
+        scpd_results[server_name] = scpd_future.result()
+
         # Test 1: GetProtocolInfo
         print("\n🔌 Test 1: ConnectionManager::GetProtocolInfo")
         print("-" * 100)
 
-        url = server_info["base"] + server_info["conn_control"]
-        soap_action = "urn:schemas-upnp-org:service:ConnectionManager:1#GetProtocolInfo"
+        print(f"URL: {server_info['base'] + server_info['conn_control']}")
+        print(f"SOAPAction: {proto_action}")
 
-        print(f"URL: {url}")
-        print(f"SOAPAction: {soap_action}")
-
-        response, status, headers = send_soap_request(url, soap_action, GET_PROTOCOL_INFO)
+        response, status, content_type = proto_future.result()
 
         if status:
             print(f"\n✅ Status: {status}")
-            if headers:
-                print(f"Content-Type: {headers.get('Content-Type', 'N/A')}")
+            print(f"Content-Type: {content_type or 'N/A'}")
             print(f"\n📄 Response ({len(response)} bytes):")
-            print(response[:1000])
+            print(response[:1000].decode('utf-8', errors='replace'))
             if len(response) > 1000:
                 print(f"... ({len(response) - 1000} more bytes)")
         else:
@@ -98,20 +180,16 @@ def main():
         print("\n\n📁 Test 2: ContentDirectory::Browse")
         print("-" * 100)
 
-        url = server_info["base"] + server_info["content_control"]
-        soap_action = "urn:schemas-upnp-org:service:ContentDirectory:1#Browse"
-
-        print(f"URL: {url}")
-        print(f"SOAPAction: {soap_action}")
+        print(f"URL: {server_info['base'] + server_info['content_control']}")
+        print(f"SOAPAction: {browse_action}")
 
-        response, status, headers = send_soap_request(url, soap_action, BROWSE_REQUEST)
+        response, status, content_type = browse_future.result()
 
         if status:
             print(f"\n✅ Status: {status}")
-            if headers:
-                print(f"Content-Type: {headers.get('Content-Type', 'N/A')}")
+            print(f"Content-Type: {content_type or 'N/A'}")
             print(f"\n📄 Response ({len(response)} bytes):")
-            print(response[:2000])
+            print(response[:2000].decode('utf-8', errors='replace'))
             if len(response) > 2000:
                 print(f"... ({len(response) - 2000} more bytes)")
         else:
@@ -132,18 +210,24 @@ def main():
 
         print(f"  ContentDirectory SCPD: {scpd_url}")
 
-        try:
-            req = Request(scpd_url, headers={'User-Agent': 'PMOMusic/1.0'})
-            response = urlopen(req, timeout=3)
-            scpd_xml = response.read().decode('utf-8')
+        # Déjà récupérée en parallèle des requêtes SOAP
+        scpd_xml = scpd_results.get(server_name, "Error: not fetched")
+        if not scpd_xml.startswith("Error"):
             print(f"    ✅ Fetched ({len(scpd_xml)} bytes)")
 
             # Vérifier les actions
-            import re
-            actions = re.findall(r'<action>.*?<name>([^<]+)</name>', scpd_xml, re.DOTALL)
+            actions = extract_scpd_actions(scpd_xml)
             print(f"    Actions: {', '.join(actions)}")
-        except Exception as e:
-            print(f"    ❌ Error: {e}")
+        else:
+            print(f"    ❌ {scpd_xml}")
+
+def main():
+    # Tout le rapport est accumulé en mémoire puis émis en une seule
+    # écriture : un syscall au lieu d'un par print
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        _run_tests()
+    sys.stdout.write(buffer.getvalue())
 
 if __name__ == "__main__":
     main()